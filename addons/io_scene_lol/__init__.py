@@ -1,5 +1,6 @@
 import bpy;
 from bpy.types import Operator;
+from bpy.props import BoolProperty, StringProperty
 from bpy_extras.io_utils import ImportHelper, ExportHelper
 
 class ExportSKN(Operator, ExportHelper):
@@ -27,6 +28,17 @@ class ImportSKN(Operator, ImportHelper):
     bl_idname = 'import_scene.skn'
     bl_label = 'Import SKN'
     bl_options = {'REGISTER', 'UNDO'}
+
+    merge_influences: BoolProperty(
+        name = 'Merge Duplicate Influences',
+        description = 'Sum influences that reference the same bone twice on one vertex',
+        default = False,
+    )
+    normalize_weights: BoolProperty(
+        name = 'Normalize Weights',
+        description = 'Rescale the weights of every vertex to sum to 1',
+        default = False,
+    )
     
     def draw(self, context):
         layout = self.layout
@@ -34,6 +46,9 @@ class ImportSKN(Operator, ImportHelper):
         layout.use_property_split = True
         layout.use_property_decorate = False
 
+        layout.prop(self, 'merge_influences')
+        layout.prop(self, 'normalize_weights')
+
     def execute(self, context):
         return self.import_skn(context)
 
@@ -43,7 +58,11 @@ class ImportSKN(Operator, ImportHelper):
         try:
             with open(self.filepath):
                 # Change so it can recognize multiple files and distinguish their types
-                skn_importer = sknImporter(self.filepath)
+                skn_importer = sknImporter(
+                    self.filepath,
+                    merge_influences = self.merge_influences,
+                    normalize_weights = self.normalize_weights,
+                )
                 skn_importer.read()
             return {'FINISHED'}
         
@@ -51,8 +70,65 @@ class ImportSKN(Operator, ImportHelper):
             self.report({'ERROR'}, e.args[0])
             return {'CANCELLED'}
 
+class ImportANM(Operator, ImportHelper):
+    """Import an ANM file onto the active armature"""
+    bl_idname = 'import_scene.anm'
+    bl_label = 'Import ANM'
+    bl_options = {'REGISTER', 'UNDO'}
+
+    hashes_path: StringProperty(
+        name = 'Bone Names',
+        description = 'Optional text file of bone names used to name tracks that have no joint',
+        subtype = 'FILE_PATH',
+    )
+
+    def draw(self, context):
+        layout = self.layout
+
+        layout.use_property_split = True
+        layout.use_property_decorate = False
+
+        layout.prop(self, 'hashes_path')
+
+    @classmethod
+    def poll(cls, context):
+        obj = context.active_object
+        return obj != None and obj.type == 'ARMATURE'
+
+    def execute(self, context):
+        return self.import_anm(context)
+
+    def import_anm(self, context):
+        from .io.importer import anmImporter, ImportError
+        from .io.skl_cache import LOL_SKL_CACHE
+        from .helper.io_helper import LoLHashTable
+        import struct
+
+        armature_object = context.active_object
+        skl_file = armature_object.get('lol_skl')
+        if skl_file == None:
+            self.report({'ERROR'}, 'Active armature was not imported from a SKN file')
+            return {'CANCELLED'}
+
+        try:
+            skeleton = LOL_SKL_CACHE.get(skl_file)
+            hash_table = LoLHashTable.load(self.hashes_path) if self.hashes_path else None
+            anm_importer = anmImporter(self.filepath, armature_object, skeleton, hash_table)
+            anm_importer.read()
+            return {'FINISHED'}
+
+        except (ImportError, OSError) as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+
+        except (AssertionError, ValueError, EOFError, struct.error) as e:
+            # Malformed or truncated files fail inside the readers, often without a message
+            self.report({'ERROR'}, 'Failed to read %s: %s' % (self.filepath, str(e) or type(e).__name__))
+            return {'CANCELLED'}
+
 def menu_func_import(self, context):
     self.layout.operator(ImportSKN.bl_idname, text='SKN 4.1 (.skn)')
+    self.layout.operator(ImportANM.bl_idname, text='ANM (.anm)')
 
 def menu_func_export(self, context):
     self.layout.operator(ExportSKN.bl_idname, text='SKN 4.1 (.skn)')
@@ -60,6 +136,7 @@ def menu_func_export(self, context):
 def register():
     bpy.utils.register_class(ExportSKN)
     bpy.utils.register_class(ImportSKN)
+    bpy.utils.register_class(ImportANM)
 
     bpy.types.TOPBAR_MT_file_import.append(menu_func_import)
     bpy.types.TOPBAR_MT_file_export.append(menu_func_export)
@@ -67,6 +144,7 @@ def register():
 def unregister():
     bpy.utils.unregister_class(ExportSKN)
     bpy.utils.unregister_class(ImportSKN)
+    bpy.utils.unregister_class(ImportANM)
 
     bpy.types.TOPBAR_MT_file_import.remove(menu_func_import)
     bpy.types.TOPBAR_MT_file_export.remove(menu_func_export)
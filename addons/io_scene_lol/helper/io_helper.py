@@ -1,8 +1,20 @@
 from __future__ import annotations
-from typing import Any, NamedTuple, List, Optional, Tuple, IO
+from typing import Any, NamedTuple, List, Optional, Tuple, IO, Dict
 from struct import Struct
 import math
+import mmap
+import os
+import numpy as np
 from mathutils import Vector, Quaternion
+from .lol_hash import lol_elf_hash, lol_elf_hash_array, LoLHashTable
+
+# lol_hash names are re-exported for the io modules
+__all__ = [
+    'LoLVec2', 'LoLVec3', 'LoLVec4', 'LoLQuat', 'LoLColor', 'LoLBox', 'LoLSphere', 'LoLForm3D',
+    'LoLIO', 'LoLBufferIO', 'LoLBuilderIO', 'LoLHashTable',
+    'lol_vec3_to_blender', 'lol_struct', 'lol_quat_dequantize', 'lol_quat_quantize', 'lol_io',
+    'lol_elf_hash', 'lol_elf_hash_array',
+]
 
 class LoLVec2(NamedTuple):
     x: float = 0.0
@@ -17,6 +29,11 @@ class LoLVec3(NamedTuple):
     def to_blender(self) -> Vector:
         return Vector((self.x, -self.z, self.y))
 
+def lol_vec3_to_blender(v: np.ndarray) -> np.ndarray:
+    # Array counterpart of LoLVec3.to_blender for (N, 3) arrays
+    v = np.asarray(v)
+    return np.stack((v[..., 0], -v[..., 2], v[..., 1]), axis = -1)
+
 class LoLVec4(NamedTuple):
     x: float = 0.0
     y: float = 0.0
@@ -34,7 +51,7 @@ class LoLQuat(NamedTuple):
     def to_blender(self) -> Quaternion:
         return Quaternion((self.w, self.x, -self.z, self.y))
     def normalize(self) -> LoLQuat:
-        n = math.sqrt(self.w ** 2 + self.x ** 2  + self.y ** 2 + self.z ** 2)
+        n = math.sqrt(self.w * self.w + self.x * self.x + self.y * self.y + self.z * self.z)
         return LoLQuat(self.x / n, self.y / n, self.z / n, self.w / n)
     @staticmethod
     def from_blender(quat:Quaternion) -> LoLQuat:
@@ -61,20 +78,65 @@ class LoLForm3D(NamedTuple):
     scale: LoLVec3
     rot: LoLQuat
 
-class LoLIO(NamedTuple):
+    @staticmethod
+    def from_floats(v: List[float]) -> LoLForm3D:
+        return LoLForm3D(LoLVec3(*v[0:3]), LoLVec3(*v[3:6]), LoLQuat(*v[6:10]))
+
+_STRUCT_CACHE: Dict[str, Struct] = {}
+
+def lol_struct(fmt: str) -> Struct:
+    struct = _STRUCT_CACHE.get(fmt)
+    if struct == None:
+        struct = _STRUCT_CACHE[fmt] = Struct(fmt)
+    return struct
+
+_I8 = lol_struct('< b')
+_U8 = lol_struct('< B')
+_I16 = lol_struct('< h')
+_U16 = lol_struct('< H')
+_I32 = lol_struct('< i')
+_U32 = lol_struct('< I')
+_I64 = lol_struct('< q')
+_U64 = lol_struct('< Q')
+_F32 = lol_struct('< f')
+_F64 = lol_struct('< d')
+_VEC2 = lol_struct('< 2f')
+_VEC3 = lol_struct('< 3f')
+_VEC4 = lol_struct('< 4f')
+_COLOR = lol_struct('< 4B')
+_BOX = lol_struct('< 6f')
+_FORM3D = lol_struct('< 10f')
+_PACK48 = lol_struct('< 3H')
+
+class LoLIO:
+    """Reader/writer over a file object."""
+
     class ScopedOffset(NamedTuple):
-        io_: IO
+        rw_: LoLIO
         old_offset_: int
         new_offset_: int
 
         def __enter__(self):
-            self.io_.seek(self.new_offset_)
+            self.rw_.seek(self.new_offset_)
             return self
 
         def __exit__(self, exec_type, exec_value, exec_trace_back):
-            self.io_.seek(self.old_offset_)
+            self.rw_.seek(self.old_offset_)
+
+    __slots__ = ('io_',)
+
+    def __init__(self, io_: IO):
+        self.io_ = io_
+
+    @property
+    def name(self) -> str:
+        return getattr(self.io_, 'name', '')
 
-    io_: IO
+    def _read(self, struct: Struct) -> Tuple:
+        return struct.unpack(self.io_.read(struct.size))
+
+    def _write(self, struct: Struct, *args: Any):
+        self.io_.write(struct.pack(*args))
 
     def tell(self) -> int:
         return self.io_.tell()
@@ -83,90 +145,92 @@ class LoLIO(NamedTuple):
         self.io_.seek(off)
 
     def seek_push(self, off: int) -> ScopedOffset:
-        return LoLIO.ScopedOffset(self.io_, self.tell(), off)
+        return LoLIO.ScopedOffset(self, self.tell(), off)
 
     def read_bytes(self, n: int) -> bytes:
         return self.io_.read(n)
-    
+
+    def read_view(self, n: int) -> bytes:
+        # Like read_bytes but buffer backends return a view instead of a copy
+        return self.io_.read(n)
+
     def write_bytes(self, v: bytes):
         self.io_.write(v)
 
     def read_struct(self, fmt: str) -> Any:
-        struct = Struct(fmt)
-        return struct.unpack(self.io_.read(struct.size))
+        return self._read(lol_struct(fmt))
 
     def write_struct(self, fmt: str, *args: Any):
-        struct = Struct(fmt)
-        self.io_.write(struct.pack(*args))
+        self._write(lol_struct(fmt), *args)
 
     def read_i8(self) -> int:
-        return self.read_struct('< b')[0]
+        return self._read(_I8)[0]
 
     def write_i8(self, v: int):
-        self.write_struct('< b', v)
+        self._write(_I8, v)
 
     def read_u8(self) -> int:
-        return self.read_struct('< B')[0]
+        return self._read(_U8)[0]
 
     def write_u8(self, v: int):
-        self.write_struct('< B', v)
+        self._write(_U8, v)
 
     def read_i16(self) -> int:
-        return self.read_struct('< h')[0]
-        
+        return self._read(_I16)[0]
+
     def write_i16(self, v: int):
-        self.write_struct('< h', v)
+        self._write(_I16, v)
 
     def read_u16(self) -> int:
-        return self.read_struct('< H')[0]
+        return self._read(_U16)[0]
 
     def write_u16(self, v: int):
-        self.write_struct('< H', v)
+        self._write(_U16, v)
 
     def read_i32(self) -> int:
-        return self.read_struct('< i')[0]
+        return self._read(_I32)[0]
 
     def write_i32(self, v: int):
-        self.write_struct('< i', v)        
+        self._write(_I32, v)
 
     def read_u32(self) -> int:
-        return self.read_struct('< I')[0]
+        return self._read(_U32)[0]
 
     def write_u32(self, v: int):
-        self.write_struct('< I', v)
+        self._write(_U32, v)
 
     def read_i64(self) -> int:
-        return self.read_struct('< q')[0]
+        return self._read(_I64)[0]
 
     def write_i64(self, v: int):
-        self.write_struct('< q', v)
+        self._write(_I64, v)
 
     def read_u64(self) -> int:
-        return self.read_struct('< Q')[0]
+        return self._read(_U64)[0]
 
     def write_u64(self, v: int):
-        self.write_struct('< Q', v)
+        self._write(_U64, v)
 
     def read_f32(self) -> float:
-        return self.read_struct('< f')[0]
+        return self._read(_F32)[0]
 
     def write_f32(self, v: float):
-        self.write_struct('< f', v)
+        self._write(_F32, v)
 
     def read_f64(self) -> float:
-        return self.read_struct('< d')[0]
+        return self._read(_F64)[0]
 
     def write_f64(self, v: float):
-        self.write_struct('< d', v)
+        self._write(_F64, v)
 
     def read_fstr(self, n: int) -> str:
-        return self.io_.read(n).split(b'\0')[0].decode('ascii')
+        return self.read_bytes(n).split(b'\0')[0].decode('ascii')
 
     def write_fstr(self, n: int, v: str):
         data = v.encode('ascii')
         assert(len(data) < n)
-        self.io_.write(data)
-        self.io_.write(b'\0' * (n - len(data)))
+        self.write_bytes(data)
+        self.write_bytes(b'\0' * (n - len(data)))
 
     def read_zstr(self) -> str:
         buffer = []
@@ -176,56 +240,41 @@ class LoLIO(NamedTuple):
 
     def write_zstr(self, v: str):
         data = v.encode('ascii')
-        self.io_.write(data)
-        self.io_.write(b'\0')
+        self.write_bytes(data)
+        self.write_bytes(b'\0')
 
     def read_vec2(self) -> LoLVec2:
-        x = self.read_f32()
-        y = self.read_f32()
-        return LoLVec2(x, y)
+        return LoLVec2(*self._read(_VEC2))
 
     def write_vec2(self, v: LoLVec2):
-        self.write_f32(v.x)
-        self.write_f32(v.y)
+        self._write(_VEC2, v.x, v.y)
 
     def read_vec3(self) -> LoLVec3:
-        x = self.read_f32()
-        y = self.read_f32()
-        z = self.read_f32()
-        return LoLVec3(x, y, z)
+        return LoLVec3(*self._read(_VEC3))
 
     def write_vec3(self, v: LoLVec3):
-        self.write_f32(v.x)
-        self.write_f32(v.y)
-        self.write_f32(v.z)
+        self._write(_VEC3, v.x, v.y, v.z)
 
     def read_vec4(self) -> LoLVec4:
-        x = self.read_f32()
-        y = self.read_f32()
-        z = self.read_f32()
-        w = self.read_f32()
-        return LoLVec4(x, y, z, w)
+        return LoLVec4(*self._read(_VEC4))
 
     def write_vec4(self, v: LoLVec4):
-        self.write_f32(v.x)
-        self.write_f32(v.y)
-        self.write_f32(v.z)
-        self.write_f32(v.w)
+        self._write(_VEC4, v.x, v.y, v.z, v.w)
 
     def read_f32_pack16(self, factor: float, offset: float = 0) -> float:
         return offset + (self.read_u16() / 65535.0) * factor
 
     def read_vec3_pack48(self, min_vec, max_vec):
-        x = self.read_f32_pack16(factor = max_vec.x - min_vec.x, offset = min_vec.x)
-        y = self.read_f32_pack16(factor = max_vec.y - min_vec.y, offset = min_vec.y)
-        z = self.read_f32_pack16(factor = max_vec.z - min_vec.z, offset = min_vec.z)
-        return LoLVec3(x, y, z)
+        x, y, z = self._read(_PACK48)
+        return LoLVec3(
+            min_vec.x + (x / 65535.0) * (max_vec.x - min_vec.x),
+            min_vec.y + (y / 65535.0) * (max_vec.y - min_vec.y),
+            min_vec.z + (z / 65535.0) * (max_vec.z - min_vec.z),
+        )
 
     def read_quat_quantized(self):
         convert = lambda v: (v / 32767.0) * math.sqrt(2.0) - 1.0 / math.sqrt(2.0)
-        bits0 = self.read_u16()
-        bits1 = self.read_u16()
-        bits2 = self.read_u16()
+        bits0, bits1, bits2 = self._read(_PACK48)
         bits = bits0 | (bits1 << 16) | (bits2 << 32)
         max_index = (bits >> 45) & 0b11
         a = convert((bits >> 30) & 0x7FFF)
@@ -241,60 +290,102 @@ class LoLIO(NamedTuple):
         else:
             return LoLQuat(a, b, c, d).normalize()
 
+    def write_quat_quantized(self, v: LoLQuat):
+        self._write(_PACK48, *lol_quat_quantize(np.array([tuple(v)]))[0].tolist())
+
+    def read_quat_quantized_array(self, count: int) -> np.ndarray:
+        return lol_quat_dequantize(self.read_u16_array(count * 3))
+
+    def write_quat_quantized_array(self, v: np.ndarray):
+        self.write_u16_array(lol_quat_quantize(v))
+
     def read_quat(self) -> LoLQuat:
-        x = self.read_f32()
-        y = self.read_f32()
-        z = self.read_f32()
-        w = self.read_f32()
-        return LoLQuat(x, y, z, w)
+        return LoLQuat(*self._read(_VEC4))
 
     def write_quat(self, v: LoLQuat):
-        self.write_f32(v.x)
-        self.write_f32(v.y)
-        self.write_f32(v.z)
-        self.write_f32(v.w)
+        self._write(_VEC4, v.x, v.y, v.z, v.w)
 
     def read_color(self) -> LoLColor:
-        r = self.read_u8() / 255.0
-        g = self.read_u8() / 255.0
-        b = self.read_u8() / 255.0
-        a = self.read_u8() / 255.0
-        return LoLColor(r, g, b, a)
+        r, g, b, a = self._read(_COLOR)
+        return LoLColor(r / 255.0, g / 255.0, b / 255.0, a / 255.0)
 
     def write_color(self, v: LoLColor):
-        self.write_u8(int(v.r * 255.0))
-        self.write_u8(int(v.g * 255.0))
-        self.write_u8(int(v.b * 255.0))
-        self.write_u8(int(v.a * 255.0))
+        self._write(_COLOR, int(v.r * 255.0), int(v.g * 255.0), int(v.b * 255.0), int(v.a * 255.0))
 
     def read_box(self) -> LoLBox:
-        start = self.read_vec3()
-        end = self.read_vec3()
-        return LoLBox(start, end)
+        sx, sy, sz, ex, ey, ez = self._read(_BOX)
+        return LoLBox(LoLVec3(sx, sy, sz), LoLVec3(ex, ey, ez))
 
     def write_box(self, v: LoLBox):
-        self.write_vec3(v.start)
-        self.write_vec3(v.end)
+        self._write(_BOX, *v.start, *v.end)
 
     def read_sphere(self) -> LoLSphere:
-        center = self.read_vec3()
-        radius = self.read_f32()
-        return LoLSphere(center, radius)
+        x, y, z, radius = self._read(_VEC4)
+        return LoLSphere(LoLVec3(x, y, z), radius)
 
     def write_sphere(self, v: LoLSphere):
-        self.write_vec3(v.center)
-        self.write_f32(v.radius)
+        self._write(_VEC4, *v.center, v.radius)
 
     def read_form3d(self) -> LoLForm3D:
-        pos = self.read_vec3()
-        scale = self.read_vec3()
-        rot = self.read_quat()
-        return LoLForm3D(pos, scale, rot)
+        px, py, pz, sx, sy, sz, rx, ry, rz, rw = self._read(_FORM3D)
+        return LoLForm3D(LoLVec3(px, py, pz), LoLVec3(sx, sy, sz), LoLQuat(rx, ry, rz, rw))
 
     def write_form3d(self, v: LoLForm3D):
-        self.write_vec3(v.pos)
-        self.write_vec3(v.scale)
-        self.write_quat(v.rot)
+        self._write(_FORM3D, *v.pos, *v.scale, *v.rot)
+
+    def read_array(self, dtype: Any, count: int) -> np.ndarray:
+        dtype = np.dtype(dtype)
+        arr = np.empty(count, dtype)
+        data = arr.view(np.uint8)
+        if self.io_.readinto(data) != len(data):
+            raise EOFError(f'Expected {count} elements of {dtype}!')
+        return arr
+
+    def write_array(self, arr: np.ndarray, dtype: Any = None):
+        arr = np.ascontiguousarray(arr, dtype)
+        self.write_bytes(memoryview(arr.reshape(-1).view(np.uint8)))
+
+    def read_u16_array(self, count: int) -> np.ndarray:
+        return self.read_array('<u2', count)
+
+    def write_u16_array(self, v: np.ndarray):
+        self.write_array(v, '<u2')
+
+    def read_i16_array(self, count: int) -> np.ndarray:
+        return self.read_array('<i2', count)
+
+    def write_i16_array(self, v: np.ndarray):
+        self.write_array(v, '<i2')
+
+    def read_u32_array(self, count: int) -> np.ndarray:
+        return self.read_array('<u4', count)
+
+    def write_u32_array(self, v: np.ndarray):
+        self.write_array(v, '<u4')
+
+    def read_f32_array(self, count: int) -> np.ndarray:
+        return self.read_array('<f4', count)
+
+    def write_f32_array(self, v: np.ndarray):
+        self.write_array(v, '<f4')
+
+    def read_vec3_array(self, count: int) -> np.ndarray:
+        return self.read_array('<f4', count * 3).reshape(count, 3)
+
+    def write_vec3_array(self, v: np.ndarray):
+        self.write_array(v, '<f4')
+
+    def read_quat_array(self, count: int) -> np.ndarray:
+        return self.read_array('<f4', count * 4).reshape(count, 4)
+
+    def write_quat_array(self, v: np.ndarray):
+        self.write_array(v, '<f4')
+
+    def read_records(self, dtype: np.dtype, count: int) -> np.ndarray:
+        return self.read_array(dtype, count)
+
+    def write_records(self, v: np.ndarray, dtype: Optional[np.dtype] = None):
+        self.write_array(v, dtype)
 
     def read_ptr(self, from_offset: Optional[int] = None) -> int:
         if from_offset == None:
@@ -316,21 +407,219 @@ class LoLIO(NamedTuple):
         rem = self.tell() % n
         if not rem:
             return b''
-        return self.io_.read(n - rem)
+        return self.read_bytes(n - rem)
 
     def write_align(self, n: int):
         rem = self.tell() % n
         if not rem:
             return
-        self.io_.write(b'\0' * (n - rem))
-
-def lol_elf_hash(v: str) -> int:
-    state = 0
-    for b in v.encode('ascii').lower():
-        state <<= 4
-        state += b 
-        high = state & 0xF0000000
-        if high:
-            state ^= high >> 24
-        state &= ~high
-    return state
+        self.write_bytes(b'\0' * (n - rem))
+
+class LoLBufferIO(LoLIO):
+    """Reader/writer over a memory-mapped file or any buffer using a cursor.
+
+    Fields are decoded with unpack_from directly from the buffer so reading
+    does no per-field syscalls or copies, and seek_push only moves the cursor.
+    """
+
+    __slots__ = ('buf_', 'view_', 'pos_', 'name_', 'mmap_')
+
+    def __init__(self, buf: Any, name: str = '', offset: int = 0):
+        self.io_ = None
+        self.buf_ = buf
+        self.view_ = memoryview(self.buf_).cast('B')
+        self.pos_ = offset
+        self.name_ = name
+        self.mmap_ = None
+
+    @staticmethod
+    def open(path: str) -> LoLBufferIO:
+        with open(path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return LoLBufferIO(b'', path)
+            buf = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+        rw = LoLBufferIO(buf, path)
+        rw.mmap_ = buf
+        return rw
+
+    def close(self):
+        self.view_.release()
+        if self.mmap_ != None:
+            self.mmap_.close()
+            self.mmap_ = None
+
+    def __enter__(self) -> LoLBufferIO:
+        return self
+
+    def __exit__(self, exec_type, exec_value, exec_trace_back):
+        self.close()
+
+    @property
+    def name(self) -> str:
+        return self.name_
+
+    def _read(self, struct: Struct) -> Tuple:
+        pos = self.pos_
+        self.pos_ = pos + struct.size
+        return struct.unpack_from(self.view_, pos)
+
+    def _write(self, struct: Struct, *args: Any):
+        pos = self.pos_
+        struct.pack_into(self.view_, pos, *args)
+        self.pos_ = pos + struct.size
+
+    def tell(self) -> int:
+        return self.pos_
+
+    def seek(self, off: int):
+        self.pos_ = off
+
+    def read_bytes(self, n: int) -> bytes:
+        return bytes(self.read_view(n))
+
+    def read_view(self, n: int) -> memoryview:
+        pos = self.pos_
+        if pos + n > len(self.view_):
+            raise EOFError(f'Reading {n} bytes at {pos} is past the end of the buffer!')
+        self.pos_ = pos + n
+        return self.view_[pos:pos + n]
+
+    def write_bytes(self, v: bytes):
+        pos = self.pos_
+        self.view_[pos:pos + len(v)] = v
+        self.pos_ = pos + len(v)
+
+    def read_array(self, dtype: Any, count: int) -> np.ndarray:
+        dtype = np.dtype(dtype)
+        data = self.read_view(dtype.itemsize * count)
+        return np.frombuffer(data, dtype, count).copy()
+
+    def read_zstr(self) -> str:
+        pos = self.pos_
+        if hasattr(self.buf_, 'find'):
+            end = self.buf_.find(b'\0', pos)
+        else:
+            end = pos
+            while end < len(self.view_) and self.view_[end]:
+                end += 1
+            if end == len(self.view_):
+                end = -1
+        if end < 0:
+            raise EOFError(f'Unterminated string at {pos}!')
+        self.pos_ = end + 1
+        return bytes(self.view_[pos:end]).decode('ascii')
+
+class LoLBuilderIO(LoLBufferIO):
+    """Writer that appends into a growing bytearray.
+
+    Pointer and size slots can be reserved and patched once their targets are
+    known, so the destination never needs to be seekable and gets the whole
+    output in a single write.
+    """
+
+    __slots__ = ('size_',)
+
+    def __init__(self, capacity: int = 0):
+        super().__init__(bytearray(capacity))
+        self.size_ = 0
+
+    @property
+    def size(self) -> int:
+        return self.size_
+
+    def _reserve(self, n: int):
+        end = self.pos_ + n
+        if end > len(self.buf_):
+            self.view_.release()
+            self.buf_.extend(bytes(max(end, 2 * len(self.buf_)) - len(self.buf_)))
+            self.view_ = memoryview(self.buf_)
+        if end > self.size_:
+            self.size_ = end
+
+    def _write(self, struct: Struct, *args: Any):
+        self._reserve(struct.size)
+        super()._write(struct, *args)
+
+    def write_bytes(self, v: bytes):
+        v = memoryview(v).cast('B')
+        self._reserve(len(v))
+        super().write_bytes(v)
+
+    def reserve_u32(self) -> int:
+        slot = self.tell()
+        self.write_u32(0)
+        return slot
+
+    def patch_u32(self, slot: int, v: int):
+        with self.seek_push(slot):
+            self.write_u32(v)
+
+    def reserve_ptr(self) -> int:
+        slot = self.tell()
+        self.write_i32(0)
+        return slot
+
+    def patch_ptr(self, slot: int, ptr: int, from_offset: Optional[int] = None):
+        with self.seek_push(slot):
+            self.write_ptr(ptr, from_offset)
+
+    def getvalue(self) -> bytes:
+        return bytes(self.view_[:self.size_])
+
+    def write_to(self, io_dst: Any):
+        with self.view_[:self.size_] as data:
+            lol_io(io_dst).write_bytes(data)
+
+def lol_quat_dequantize(data: np.ndarray) -> np.ndarray:
+    """Decode N 48-bit quantized quaternions, given as (N, 3) little endian u16 words,
+    into an (N, 4) float64 array of normalized x, y, z, w.
+
+    Mirrors LoLIO.read_quat_quantized operation for operation so results are bit-identical.
+    """
+    words = np.asarray(data, dtype = np.uint64).reshape(-1, 3)
+    bits = words[:, 0] | (words[:, 1] << np.uint64(16)) | (words[:, 2] << np.uint64(32))
+    max_index = ((bits >> np.uint64(45)) & np.uint64(0b11)).astype(np.intp)
+    abc = np.stack((
+        (bits >> np.uint64(30)) & np.uint64(0x7FFF),
+        (bits >> np.uint64(15)) & np.uint64(0x7FFF),
+        bits & np.uint64(0x7FFF),
+    ), axis = 1).astype(np.float64)
+    abc = (abc / 32767.0) * math.sqrt(2.0) - 1.0 / math.sqrt(2.0)
+    a, b, c = abc[:, 0], abc[:, 1], abc[:, 2]
+    d = np.sqrt(np.maximum(0.0, 1.0 - (a * a + b * b + c * c)))
+
+    # Insert the largest component back at max_index
+    quats = np.empty((len(words), 4), dtype = np.float64)
+    for i in range(0, 4):
+        before = abc[:, min(i, 2)]
+        after = abc[:, max(i - 1, 0)]
+        quats[:, i] = np.where(max_index == i, d, np.where(max_index > i, before, after))
+
+    x, y, z, w = quats[:, 0], quats[:, 1], quats[:, 2], quats[:, 3]
+    n = np.sqrt(w * w + x * x + y * y + z * z)
+    return quats / n[:, None]
+
+def lol_quat_quantize(quats: np.ndarray) -> np.ndarray:
+    """Encode (N, 4) x, y, z, w quaternions into (N, 3) u16 words of the 48-bit quantized format."""
+    quats = np.asarray(quats, dtype = np.float64).reshape(-1, 4)
+    quats = quats / np.linalg.norm(quats, axis = 1, keepdims = True)
+    rows = np.arange(len(quats))
+    max_index = np.argmax(np.abs(quats), axis = 1)
+    # q and -q are the same rotation, make the dropped component positive
+    quats = quats * np.where(quats[rows, max_index] < 0.0, -1.0, 1.0)[:, None]
+    keep = np.array([[1, 2, 3], [0, 2, 3], [0, 1, 3], [0, 1, 2]])[max_index]
+    abc = quats[rows[:, None], keep]
+    abc = np.rint((abc + 1.0 / math.sqrt(2.0)) / math.sqrt(2.0) * 32767.0)
+    abc = np.clip(abc, 0, 0x7FFF).astype(np.uint64)
+    bits = (max_index.astype(np.uint64) << np.uint64(45)) \
+        | (abc[:, 0] << np.uint64(30)) | (abc[:, 1] << np.uint64(15)) | abc[:, 2]
+    return np.stack((
+        bits & np.uint64(0xFFFF),
+        (bits >> np.uint64(16)) & np.uint64(0xFFFF),
+        (bits >> np.uint64(32)) & np.uint64(0xFFFF),
+    ), axis = 1).astype(np.uint16)
+
+def lol_io(src: Any) -> LoLIO:
+    if isinstance(src, LoLIO):
+        return src
+    return LoLIO(src)
@@ -0,0 +1,92 @@
+from __future__ import annotations
+from typing import Dict, Iterable, List, Optional
+from functools import lru_cache
+import numpy as np
+
+def _lol_elf_hash(v: str) -> int:
+    state = 0
+    for b in v.encode('ascii').lower():
+        state = ((state << 4) + b) & 0xFFFFFFFF
+        high = state & 0xF0000000
+        if high:
+            state ^= high >> 24
+        state &= ~high
+    return state
+
+@lru_cache(maxsize = 4096)
+def lol_elf_hash(v: str) -> int:
+    """Lowercase ELF hash of bone and joint names, memoized for names seen again."""
+    return _lol_elf_hash(v)
+
+def lol_elf_hash_array(names: Iterable[str]) -> np.ndarray:
+    """ELF hash every name in one pass over the characters, returns an (N,) u32 array."""
+    encoded = [name.encode('ascii').lower() for name in names]
+    if not encoded:
+        return np.zeros(0, dtype = np.uint32)
+    lengths = np.array([len(name) for name in encoded], dtype = np.intp)
+    # (N, longest) characters padded with zeros, column j holds character j of every name
+    chars = np.zeros((len(encoded), max(lengths.max(), 1)), dtype = np.uint8)
+    for i, name in enumerate(encoded):
+        chars[i, :len(name)] = np.frombuffer(name, dtype = np.uint8)
+    chars = chars.astype(np.uint64)
+
+    state = np.zeros(len(encoded), dtype = np.uint64)
+    for j in range(chars.shape[1]):
+        next_state = ((state << np.uint64(4)) + chars[:, j]) & np.uint64(0xFFFFFFFF)
+        high = next_state & np.uint64(0xF0000000)
+        next_state ^= high >> np.uint64(24)
+        next_state &= ~high
+        state = np.where(j < lengths, next_state, state)
+    return state.astype(np.uint32)
+
+class LoLHashTable:
+    """Reverse hash -> name table for names that are only stored hashed (ANM v4/v5/canm bone hashes)."""
+
+    __slots__ = ('names',)
+
+    def __init__(self, names: Optional[Dict[int, str]] = None):
+        self.names = names if names != None else {}
+
+    @staticmethod
+    def load(path: str) -> LoLHashTable:
+        """Load a plain-text dictionary, one name per line.
+
+        Lines may also be "<hex hash> <name>" to keep a precomputed hash.
+        """
+        table = LoLHashTable()
+        with open(path, 'r', encoding = 'ascii', errors = 'ignore') as file:
+            table.add_lines(file)
+        return table
+
+    def add_lines(self, lines: Iterable[str]):
+        names = []
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            parts = line.split(maxsplit = 1)
+            if len(parts) == 2:
+                try:
+                    self.names.setdefault(int(parts[0], 16), parts[1])
+                    continue
+                except ValueError:
+                    pass
+            names.append(line)
+        self.add_names(names)
+
+    def add_names(self, names: List[str]):
+        for name_hash, name in zip(lol_elf_hash_array(names).tolist(), names):
+            self.names.setdefault(name_hash, name)
+
+    def get(self, name_hash: int, default: Optional[str] = None) -> Optional[str]:
+        return self.names.get(name_hash, default)
+
+    def resolve(self, name_hashes: Iterable[int]) -> List[str]:
+        """Names of every hash, unknown hashes are formatted as hex."""
+        return [self.names.get(name_hash, f'{name_hash:08x}') for name_hash in name_hashes]
+
+    def __contains__(self, name_hash: int) -> bool:
+        return name_hash in self.names
+
+    def __len__(self) -> int:
+        return len(self.names)
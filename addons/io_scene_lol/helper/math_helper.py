@@ -0,0 +1,173 @@
+from __future__ import annotations
+from typing import List, Tuple
+import numpy as np
+
+# Basis change from LoL (y up) to Blender (z up) space, same as LoLVec3.to_blender
+LOL_TO_BLENDER = np.array((
+    (1.0, 0.0, 0.0, 0.0),
+    (0.0, 0.0, -1.0, 0.0),
+    (0.0, 1.0, 0.0, 0.0),
+    (0.0, 0.0, 0.0, 1.0),
+), dtype = np.float64)
+
+def lol_quat_to_matrix(rotations: np.ndarray) -> np.ndarray:
+    """Convert (..., 4) x, y, z, w quaternions into (..., 3, 3) rotation matrices."""
+    q = np.asarray(rotations, dtype = np.float64)
+    q = q / np.linalg.norm(q, axis = -1, keepdims = True)
+    x, y, z, w = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    m = np.empty(q.shape[:-1] + (3, 3), dtype = np.float64)
+    m[..., 0, 0] = 1.0 - 2.0 * (y * y + z * z)
+    m[..., 0, 1] = 2.0 * (x * y - z * w)
+    m[..., 0, 2] = 2.0 * (x * z + y * w)
+    m[..., 1, 0] = 2.0 * (x * y + z * w)
+    m[..., 1, 1] = 1.0 - 2.0 * (x * x + z * z)
+    m[..., 1, 2] = 2.0 * (y * z - x * w)
+    m[..., 2, 0] = 2.0 * (x * z - y * w)
+    m[..., 2, 1] = 2.0 * (y * z + x * w)
+    m[..., 2, 2] = 1.0 - 2.0 * (x * x + y * y)
+    return m
+
+def lol_matrix_to_quat(m: np.ndarray) -> np.ndarray:
+    """Convert (..., 3, 3) rotation matrices into (..., 4) w, x, y, z quaternions (Blender order)."""
+    m = np.asarray(m, dtype = np.float64)
+    m00, m01, m02 = m[..., 0, 0], m[..., 0, 1], m[..., 0, 2]
+    m10, m11, m12 = m[..., 1, 0], m[..., 1, 1], m[..., 1, 2]
+    m20, m21, m22 = m[..., 2, 0], m[..., 2, 1], m[..., 2, 2]
+    # Candidate for each largest component, pick the numerically stable one per matrix
+    candidates = np.stack((
+        np.stack((1.0 + m00 + m11 + m22, m21 - m12, m02 - m20, m10 - m01), axis = -1),
+        np.stack((m21 - m12, 1.0 + m00 - m11 - m22, m01 + m10, m02 + m20), axis = -1),
+        np.stack((m02 - m20, m01 + m10, 1.0 - m00 + m11 - m22, m12 + m21), axis = -1),
+        np.stack((m10 - m01, m02 + m20, m12 + m21, 1.0 - m00 - m11 + m22), axis = -1),
+    ), axis = -2)
+    best = np.argmax(np.diagonal(candidates, axis1 = -2, axis2 = -1), axis = -1)
+    q = np.take_along_axis(candidates, best[..., None, None], axis = -2)[..., 0, :]
+    q /= np.linalg.norm(q, axis = -1, keepdims = True)
+    # Keep w positive for a canonical result
+    return np.where(q[..., :1] < 0.0, -q, q)
+
+def lol_form3d_to_matrix(positions: np.ndarray, scales: np.ndarray, rotations: np.ndarray) -> np.ndarray:
+    """Compose (..., 4, 4) translation @ rotation @ scale matrices from LoL transform arrays."""
+    positions = np.asarray(positions, dtype = np.float64)
+    m = np.zeros(positions.shape[:-1] + (4, 4), dtype = np.float64)
+    m[..., :3, :3] = lol_quat_to_matrix(rotations) * np.asarray(scales, dtype = np.float64)[..., None, :]
+    m[..., :3, 3] = positions
+    m[..., 3, 3] = 1.0
+    return m
+
+def lol_matrix_to_blender(m: np.ndarray) -> np.ndarray:
+    """Express (..., 4, 4) LoL space transforms in Blender space."""
+    return LOL_TO_BLENDER @ m @ LOL_TO_BLENDER.T
+
+def lol_matrix_decompose(m: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Split (..., 4, 4) matrices into locations, w, x, y, z rotations and scales."""
+    m = np.asarray(m, dtype = np.float64)
+    locations = m[..., :3, 3].copy()
+    scales = np.linalg.norm(m[..., :3, :3], axis = -2)
+    rotations = lol_matrix_to_quat(m[..., :3, :3] / np.where(scales > 0.0, scales, 1.0)[..., None, :])
+    return locations, rotations, scales
+
+def lol_quat_make_continuous(q: np.ndarray) -> np.ndarray:
+    """Flip signs along axis 0 so consecutive quaternions never take the long way around."""
+    q = np.array(q, dtype = np.float64)
+    if len(q) > 1:
+        dots = np.sum(q[1:] * q[:-1], axis = -1)
+        signs = np.cumprod(np.where(dots < 0.0, -1.0, 1.0), axis = 0)
+        q[1:] *= signs[..., None]
+    return q
+
+def _lol_sphere_from_support(support: np.ndarray) -> Tuple[np.ndarray, float]:
+    """Smallest sphere with up to 4 points on its surface."""
+    count = len(support)
+    if count == 0:
+        return np.zeros(3), -1.0
+    if count == 1:
+        return support[0].copy(), 0.0
+    if count == 2:
+        center = (support[0] + support[1]) / 2.0
+        return center, float(np.linalg.norm(support[0] - center))
+    a = support[1:] - support[0]
+    if count == 3:
+        normal = np.cross(a[0], a[1])
+        denominator = 2.0 * np.dot(normal, normal)
+        if denominator > 1e-12:
+            offset = (np.dot(a[0], a[0]) * np.cross(a[1], normal) + np.dot(a[1], a[1]) * np.cross(normal, a[0])) / denominator
+            return support[0] + offset, float(np.linalg.norm(offset))
+    else:
+        matrix = 2.0 * a
+        if abs(np.linalg.det(matrix)) > 1e-12:
+            offset = np.linalg.solve(matrix, np.sum(a * a, axis = 1))
+            return support[0] + offset, float(np.linalg.norm(offset))
+    # Degenerate support, the sphere through fewer of the points covers the rest
+    best_center, best_radius = None, np.inf
+    for skip in range(count):
+        center, radius = _lol_sphere_from_support(np.delete(support, skip, axis = 0))
+        if radius < best_radius and (np.linalg.norm(support - center, axis = 1) <= radius * (1.0 + 1e-9) + 1e-9).all():
+            best_center, best_radius = center, radius
+    return best_center, best_radius
+
+def _lol_sphere_welzl(points: np.ndarray) -> Tuple[np.ndarray, float]:
+    """Exact minimal sphere of a small point set, Welzl's algorithm with move to front."""
+    points = list(points)
+
+    def welzl(count: int, support: List[np.ndarray]) -> Tuple[np.ndarray, float]:
+        center, radius = _lol_sphere_from_support(np.array(support).reshape(-1, 3))
+        if len(support) == 4:
+            return center, radius
+        for i in range(count):
+            point = points[i]
+            if radius < 0.0 or np.linalg.norm(point - center) > radius * (1.0 + 1e-9) + 1e-9:
+                center, radius = welzl(i, support + [point])
+                # Move to front so later passes meet it early
+                points.insert(0, points.pop(i))
+        return center, radius
+
+    return welzl(len(points), [])
+
+def lol_bounding_sphere(points: np.ndarray, exact = False) -> Tuple[np.ndarray, float]:
+    """Tight bounding sphere (center, radius) of (N, 3) points.
+
+    The default is Ritter's sphere refined by shrinking and regrowing it. With exact the minimal sphere
+    is found by Welzl's algorithm on a small core set that grows with the farthest outside point.
+    """
+    points = np.asarray(points, dtype = np.float64).reshape(-1, 3)
+    if not len(points):
+        return np.zeros(3), 0.0
+
+    def farthest(center: np.ndarray) -> Tuple[int, float]:
+        offsets = points - center
+        distances = np.einsum('ij,ij->i', offsets, offsets)
+        idx = int(np.argmax(distances))
+        return idx, float(np.sqrt(distances[idx]))
+
+    if exact:
+        # Start from the extreme points along each axis
+        core = list(np.unique(np.concatenate((points.argmin(axis = 0), points.argmax(axis = 0)))))
+        while True:
+            center, radius = _lol_sphere_welzl(points[core])
+            idx, distance = farthest(center)
+            if distance <= radius * (1.0 + 1e-9) + 1e-9 or idx in core:
+                return center, max(radius, distance)
+            core.append(idx)
+
+    def grow(center: np.ndarray, radius: float) -> Tuple[np.ndarray, float]:
+        # Pull the sphere towards the farthest outside point until it covers everything
+        while True:
+            idx, distance = farthest(center)
+            if distance <= radius * (1.0 + 1e-6):
+                return center, max(radius, distance)
+            new_radius = (radius + distance) / 2.0
+            center = center + (points[idx] - center) * ((new_radius - radius) / distance)
+            radius = new_radius
+
+    # Ritter: the sphere over an approximate diameter, grown to cover the rest
+    first, _ = farthest(points[0])
+    second, _ = farthest(points[first])
+    center, radius = grow((points[first] + points[second]) / 2.0, float(np.linalg.norm(points[first] - points[second])) / 2.0)
+    # Refine by shrinking and regrowing, keeping the smallest sphere found
+    for _ in range(8):
+        shrunk_center, shrunk_radius = grow(center, radius * 0.95)
+        if shrunk_radius >= radius:
+            break
+        center, radius = shrunk_center, shrunk_radius
+    return center, radius
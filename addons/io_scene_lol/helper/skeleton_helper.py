@@ -0,0 +1,59 @@
+from __future__ import annotations
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+from .math_helper import lol_form3d_to_matrix, lol_matrix_to_blender
+
+def lol_joint_transforms(joints: Sequence) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Local positions (J, 3), scales (J, 3), x, y, z, w rotations (J, 4) and parent indices (J,) of SKL joints."""
+    forms = np.array([
+        tuple(joint.local_transform.pos) + tuple(joint.local_transform.scale) + tuple(joint.local_transform.rot)
+        for joint in joints
+    ], dtype = np.float64).reshape(-1, 10)
+    parent_indices = np.array([joint.parent_idx for joint in joints], dtype = np.intp)
+    return forms[:, 0:3], forms[:, 3:6], forms[:, 6:10], parent_indices
+
+def lol_joint_depths(parent_indices: np.ndarray) -> np.ndarray:
+    """Number of ancestors of every joint, roots (parent -1) have depth 0."""
+    parent_indices = np.asarray(parent_indices, dtype = np.intp)
+    joint_count = len(parent_indices)
+    if ((parent_indices < -1) | (parent_indices >= joint_count)).any():
+        raise ValueError('Joint parent index out of range!')
+    depths = np.zeros(joint_count, dtype = np.intp)
+    ancestors = parent_indices.copy()
+    # Walk every joint up one parent per step, a chain can not be longer than the joint count
+    for _ in range(joint_count + 1):
+        has_ancestor = ancestors > -1
+        if not has_ancestor.any():
+            return depths
+        depths += has_ancestor
+        ancestors = np.where(has_ancestor, parent_indices[ancestors], -1)
+    raise ValueError('Joint parents form a cycle!')
+
+def lol_joint_levels(parent_indices: np.ndarray) -> List[np.ndarray]:
+    """Joint indices grouped by depth, each level only has parents in the levels before it."""
+    depths = lol_joint_depths(parent_indices)
+    order = np.argsort(depths, kind = 'stable')
+    bounds = np.searchsorted(depths[order], np.arange(depths.max() + 2 if len(depths) else 1))
+    return [order[bounds[depth]:bounds[depth + 1]] for depth in range(len(bounds) - 1)]
+
+def lol_world_matrices(local_matrices: np.ndarray, parent_indices: np.ndarray,
+        levels: Optional[List[np.ndarray]] = None) -> np.ndarray:
+    """Compose (..., J, 4, 4) parent-local matrices into world matrices, one batched product per level.
+
+    Works for any joint order, leading dimensions (e.g. frames) are composed all at once.
+    """
+    parent_indices = np.asarray(parent_indices, dtype = np.intp)
+    if levels == None:
+        levels = lol_joint_levels(parent_indices)
+    world = np.array(local_matrices, dtype = np.float64)
+    for level in levels[1:]:
+        world[..., level, :, :] = world[..., parent_indices[level], :, :] @ world[..., level, :, :]
+    return world
+
+def lol_skeleton_world_matrices(joints: Sequence, blender_space = False) -> np.ndarray:
+    """Rest (J, 4, 4) world matrices of SKL joints including joint scale, optionally in Blender space."""
+    positions, scales, rotations, parent_indices = lol_joint_transforms(joints)
+    world = lol_world_matrices(lol_form3d_to_matrix(positions, scales, rotations), parent_indices)
+    if blender_space:
+        world = lol_matrix_to_blender(world)
+    return world
@@ -1,22 +1,355 @@
 from __future__ import annotations
-from typing import NamedTuple, List, IO, Optional
-from ..helper.io_helper import LoLIO, LoLForm3D, LoLQuat, LoLVec3
-from ..helper.io_helper import lol_elf_hash as lol_bone_hash
+from typing import NamedTuple, List, IO, Optional, Sequence, Tuple, Union
+from ..helper.io_helper import LoLBufferIO, LoLBuilderIO, LoLForm3D, LoLQuat, LoLVec3, lol_io, lol_quat_dequantize, lol_quat_quantize
+from ..helper.io_helper import lol_elf_hash_array
+import math
 import os
+import numpy as np
+
+ANM_V3_FRAME_DTYPE = np.dtype([
+    ('rot', '<f4', (4,)),
+    ('pos', '<f4', (3,)),
+])
+ANM_V4_FRAME_DTYPE = np.dtype([
+    ('bone_hash', '<u4'),
+    ('pos_idx', '<u2'),
+    ('scale_idx', '<u2'),
+    ('rot_idx', '<u2'),
+    ('pad', '<u2'),
+])
+ANM_V5_FRAME_DTYPE = np.dtype([
+    ('pos_idx', '<u2'),
+    ('scale_idx', '<u2'),
+    ('rot_idx', '<u2'),
+])
+CANM_V1_FRAME_DTYPE = np.dtype([
+    ('time', '<u2'),
+    ('bits', '<u2'),
+    ('data', '<u2', (3,)),
+])
 
 class LoLANM(NamedTuple):
-    class Track(NamedTuple):
-        frames: List[LoLForm3D]
-        bone_hash: int
+    class Curve(NamedTuple):
+        """Sparse keyframes of one channel (rotation, position or scale) of a compressed track."""
+        times: np.ndarray   # (K,) seconds, ascending
+        values: np.ndarray  # (K, 4) x, y, z, w quaternions or (K, 3) vectors
+        is_rotation: bool = False
+        jump_keys: Optional[np.ndarray] = None # (J,) key index at the start of each jump cache span
+        jump_step: float = 0.0 # seconds covered by one jump cache entry
+
+        def seek(self, time: float) -> int:
+            """Index of the last key at or before time (0 if time is before the first key)."""
+            times = self.times
+            key = 0
+            if self.jump_keys is not None and len(self.jump_keys) and self.jump_step > 0.0:
+                jump = min(max(int(time / self.jump_step), 0), len(self.jump_keys) - 1)
+                key = min(int(self.jump_keys[jump]), len(times) - 1)
+            # The jump cache lands at most a few keys away, walk the rest
+            while key > 0 and times[key] > time:
+                key -= 1
+            while key + 1 < len(times) and times[key + 1] <= time:
+                key += 1
+            return key
+
+        def evaluate(self, time: float) -> np.ndarray:
+            key = self.seek(time)
+            if key + 1 >= len(self.times) or time <= self.times[key]:
+                return self.values[key]
+            t0, t1 = self.times[key], self.times[key + 1]
+            alpha = (time - t0) / (t1 - t0)
+            return lol_anm_interpolate(self.values[key:key + 1], self.values[key + 1:key + 2], np.array([alpha]), self.is_rotation)[0]
+
+        def sample(self, times: np.ndarray) -> np.ndarray:
+            """Evaluate at many sorted or unsorted times at once."""
+            times = np.asarray(times, dtype = np.float64)
+            keys = np.clip(np.searchsorted(self.times, times, side = 'right') - 1, 0, len(self.times) - 1)
+            next_keys = np.minimum(keys + 1, len(self.times) - 1)
+            t0, t1 = self.times[keys], self.times[next_keys]
+            span = np.where(t1 > t0, t1 - t0, 1.0)
+            alpha = np.clip((times - t0) / span, 0.0, 1.0)
+            return lol_anm_interpolate(self.values[keys], self.values[next_keys], alpha, self.is_rotation)
+
+    class FrameView(Sequence):
+        """Lazy read-only list of LoLForm3D over a track's arrays."""
+        __slots__ = ('track',)
+
+        def __init__(self, track: LoLANM.Track):
+            self.track = track
+
+        def __len__(self) -> int:
+            return len(self.track.positions)
+
+        def __getitem__(self, idx: Union[int, slice]) -> Union[LoLForm3D, List[LoLForm3D]]:
+            if isinstance(idx, slice):
+                return [self[i] for i in range(*idx.indices(len(self)))]
+            t = self.track
+            return LoLForm3D(
+                pos = LoLVec3(*t.positions[idx].tolist()),
+                scale = LoLVec3(*t.scales[idx].tolist()),
+                rot = LoLQuat(*t.rotations[idx].tolist()),
+            )
+
+        def __iter__(self):
+            t = self.track
+            for pos, scale, rot in zip(t.positions.tolist(), t.scales.tolist(), t.rotations.tolist()):
+                yield LoLForm3D(pos = LoLVec3(*pos), scale = LoLVec3(*scale), rot = LoLQuat(*rot))
+
+    class Track:
+        """Animation of one bone stored as contiguous float32 (frames, 3 | 4) arrays."""
+
+        __slots__ = ('bone_hash', 'positions', 'scales', 'rotations', 'rot_curve', 'pos_curve', 'scale_curve')
+
+        # NOTE: curves are only set for compressed (r3d2canm) tracks, frames are then sampled from them
+
+        def __init__(self, bone_hash: int, positions: np.ndarray, scales: np.ndarray, rotations: np.ndarray,
+                rot_curve: Optional[LoLANM.Curve] = None, pos_curve: Optional[LoLANM.Curve] = None,
+                scale_curve: Optional[LoLANM.Curve] = None):
+            self.bone_hash = bone_hash
+            self.positions = np.ascontiguousarray(positions, dtype = np.float32).reshape(-1, 3)
+            self.scales = np.ascontiguousarray(scales, dtype = np.float32).reshape(-1, 3)
+            self.rotations = np.ascontiguousarray(rotations, dtype = np.float32).reshape(-1, 4)
+            self.rot_curve = rot_curve
+            self.pos_curve = pos_curve
+            self.scale_curve = scale_curve
+
+        @staticmethod
+        def from_frames(frames: List[LoLForm3D], bone_hash: int) -> LoLANM.Track:
+            return LoLANM.Track(
+                bone_hash = bone_hash,
+                positions = [frame.pos for frame in frames],
+                scales = [frame.scale for frame in frames],
+                rotations = [frame.rot for frame in frames],
+            )
+
+        @property
+        def frames(self) -> LoLANM.FrameView:
+            return LoLANM.FrameView(self)
+
+        @property
+        def frame_count(self) -> int:
+            return len(self.positions)
+
+        def __eq__(self, other) -> bool:
+            if not isinstance(other, LoLANM.Track):
+                return NotImplemented
+            return self.bone_hash == other.bone_hash \
+                and np.array_equal(self.positions, other.positions) \
+                and np.array_equal(self.scales, other.scales) \
+                and np.array_equal(self.rotations, other.rotations)
+
+        __hash__ = None
+
+        def __repr__(self) -> str:
+            return f'LoLANM.Track(bone_hash = {self.bone_hash:#010x}, frame_count = {self.frame_count})'
+
+    class Pool:
+        """Deduplicated value pool of a v5 writer, keyed by a hash index over value rows.
+
+        Tracks are added one at a time so only the unique values are kept around.
+        """
+
+        __slots__ = ('values', 'index')
+
+        def __init__(self):
+            self.values = []
+            self.index = {}
+
+        def add(self, values: np.ndarray, keys: np.ndarray) -> np.ndarray:
+            """Add (N, C) values, rows with equal (N, C) integer keys share an entry. Returns (N,) pool indices."""
+            unique_keys, first, inverse = np.unique(keys, axis = 0, return_index = True, return_inverse = True)
+            indices = np.empty(len(unique_keys), dtype = np.int64)
+            for i, key in enumerate(unique_keys):
+                key = key.tobytes()
+                idx = self.index.get(key)
+                if idx == None:
+                    idx = len(self.values)
+                    self.index[key] = idx
+                    self.values.append(values[first[i]])
+                indices[i] = idx
+            return indices[inverse.reshape(-1)]
+
+        def __len__(self) -> int:
+            return len(self.values)
+
+    class Header(NamedTuple):
+        """Format, counts, timing and bone hashes of an animation, see LoLANM.probe."""
+        magic: bytes
+        version: int
+        track_count: int
+        frame_count: int
+        fps: float
+        duration: float
+        bone_hashes: np.ndarray # (N,) u32 in track order
+        asset_name: str = ""
+        flags: int = 0
+        bone_names: Optional[List[str]] = None # only stored by v3
+
+    class Lazy:
+        """Animation whose tracks are only decoded when first accessed."""
+
+        __slots__ = ('header', 'rw_', 'start_', 'anm_')
+
+        def __init__(self, io_src: IO):
+            self.rw_ = lol_io(io_src)
+            self.start_ = self.rw_.tell()
+            self.header = LoLANM.probe(self.rw_)
+            self.anm_ = None
+
+        @staticmethod
+        def open(path: str) -> LoLANM.Lazy:
+            return LoLANM.Lazy(LoLBufferIO.open(path))
+
+        def close(self):
+            if isinstance(self.rw_, LoLBufferIO):
+                self.rw_.close()
+
+        def __enter__(self) -> LoLANM.Lazy:
+            return self
+
+        def __exit__(self, exec_type, exec_value, exec_trace_back):
+            self.close()
+
+        @property
+        def tracks(self) -> List[LoLANM.Track]:
+            return self.load().tracks
+
+        def load(self) -> LoLANM:
+            if self.anm_ == None:
+                with self.rw_.seek_push(self.start_):
+                    self.anm_ = LoLANM.read(self.rw_)
+            return self.anm_
 
     tracks: List[Track]
     tick_duration: float
     asset_name: str = ""
     flags: int = 0
 
+    @staticmethod
+    def probe(io_src: IO) -> LoLANM.Header:
+        """Read the header and bone hashes without touching frame data."""
+        rw = lol_io(io_src)
+        magic =  rw.read_bytes(8)
+        version = rw.read_u32()
+        file_name = os.path.splitext(os.path.basename(rw.name))[0]
+
+        def probe_anmd_v3():
+            anm_id = rw.read_u32()
+            anm_num_tracks = rw.read_u32()
+            anm_num_frames = rw.read_u32()
+            anm_frame_frate = rw.read_i32()
+
+            # Track records are fixed size, only read each bone name
+            off_tracks = rw.tell()
+            track_size = 32 + 4 + anm_num_frames * ANM_V3_FRAME_DTYPE.itemsize
+            bone_names = []
+            for track_idx in range(0, anm_num_tracks):
+                with rw.seek_push(off_tracks + track_idx * track_size):
+                    bone_names.append(rw.read_bytes(32).split(b'\0')[0].decode('ascii'))
+
+            header = LoLANM.Header(
+                magic = magic,
+                version = version,
+                track_count = anm_num_tracks,
+                frame_count = anm_num_frames,
+                fps = float(anm_frame_frate),
+                duration = max(anm_num_frames - 1, 0) / anm_frame_frate,
+                bone_hashes = lol_elf_hash_array(bone_names),
+                asset_name = file_name,
+                bone_names = bone_names,
+            )
+            return header
+
+        def probe_anmd_v4_v5():
+            start = rw.tell()
+
+            anm_size = rw.read_u32()
+            anm_magic = rw.read_u32()
+            anm_version = rw.read_u32()
+            anm_flags = rw.read_u32()
+            anm_num_tracks = rw.read_u32()
+            anm_num_frames = rw.read_u32()
+            anm_tick_duration = rw.read_f32()
+            anm_off_bone_hashes = rw.read_ptr(start)
+            anm_off_asset_name = rw.read_ptr(start)
+            anm_off_time = rw.read_ptr(start)
+            anm_off_vectors = rw.read_ptr(start)
+            anm_off_quats = rw.read_ptr(start)
+            anm_off_frames = rw.read_ptr(start)
+
+            asset_name = ""
+            if anm_off_asset_name:
+                with rw.seek_push(anm_off_asset_name):
+                    asset_name = rw.read_zstr()
+
+            # v4 has no bone hash list, the first frame holds a record of every track
+            bone_hashes = np.zeros(0, dtype = np.uint32)
+            if anm_num_tracks and version == 4 and anm_num_frames:
+                with rw.seek_push(anm_off_frames):
+                    bone_hashes = rw.read_records(ANM_V4_FRAME_DTYPE, anm_num_tracks)['bone_hash']
+            elif anm_num_tracks and version == 5:
+                with rw.seek_push(anm_off_bone_hashes):
+                    bone_hashes = rw.read_u32_array(anm_num_tracks)
+
+            header = LoLANM.Header(
+                magic = magic,
+                version = version,
+                track_count = anm_num_tracks,
+                frame_count = anm_num_frames,
+                fps = 1.0 / anm_tick_duration,
+                duration = max(anm_num_frames - 1, 0) * anm_tick_duration,
+                bone_hashes = bone_hashes,
+                asset_name = asset_name if asset_name != '' else file_name,
+                flags = anm_flags,
+            )
+            return header
+
+        def probe_canm_v1():
+            start = rw.tell()
+
+            anm_size = rw.read_u32()
+            anm_magic = rw.read_u32()
+            anm_flags = rw.read_u32()
+            anm_num_tracks = rw.read_u32()
+            anm_num_frame_parts = rw.read_u32()
+            anm_num_jump_caches = rw.read_u32()
+            anm_total_duration = rw.read_f32()
+            anm_fps = rw.read_f32()
+            # Skip error margins, discontinuity thresholds and quantization ranges
+            rw.seek(rw.tell() + 6 * 4 + 4 * 12)
+            anm_off_frames = rw.read_ptr(start)
+            anm_off_jump_cache = rw.read_ptr(start)
+            anm_off_bone_hashes = rw.read_ptr(start)
+
+            bone_hashes = np.zeros(0, dtype = np.uint32)
+            if anm_num_tracks:
+                with rw.seek_push(anm_off_bone_hashes):
+                    bone_hashes = rw.read_u32_array(anm_num_tracks)
+
+            header = LoLANM.Header(
+                magic = magic,
+                version = version,
+                track_count = anm_num_tracks,
+                frame_count = int(round(anm_total_duration * anm_fps)) + 1,
+                fps = anm_fps,
+                duration = anm_total_duration,
+                bone_hashes = bone_hashes,
+                asset_name = file_name,
+                flags = anm_flags,
+            )
+            return header
+
+        if magic == b'r3d2anmd' and version == 3:
+            return probe_anmd_v3()
+        elif magic == b'r3d2anmd' and version in (4, 5):
+            return probe_anmd_v4_v5()
+        elif magic == b'r3d2canm' and version == 1:
+            return probe_canm_v1()
+        else:
+            raise ValueError(f'Unsupported LoLANM with magic = {repr(magic)} and version = {version:#08X}!')
+
     @staticmethod
     def read(io_src: IO, full_read = False) -> LoLANM:
-        rw = LoLIO(io_src)
+        rw = lol_io(io_src)
         magic =  rw.read_bytes(8)
         version = rw.read_u32()
 
@@ -26,33 +359,27 @@ class LoLANM(NamedTuple):
             anm_num_frames = rw.read_u32()
             anm_frame_frate = rw.read_i32()
 
-            tracks = []
-            for _ in range(0, anm_num_tracks):
-                bone_name = rw.read_fstr(32)
-                track_flags = rw.read_u32()
-                bone_hash = lol_bone_hash(bone_name)
-                track_frames = []
-                for _ in range(0, anm_num_frames):
-                    frame_rot = rw.read_quat()
-                    frame_scale = LoLVec3(1.0, 1.0, 1.0)
-                    frame_pos = rw.read_vec3()
-                    frame = LoLForm3D(
-                        pos = frame_pos,
-                        scale = frame_scale,
-                        rot = frame_rot,
-                        )
-                    track_frames.append(frame)
-                track = LoLANM.Track(
-                    frames = track_frames,
-                    bone_hash = bone_hash,
-                )
-                tracks.append(track)
-            if asset_name is '':
-                asset_name = os.path.splitext(os.path.basename(io_src.name))[0]
+            anm_track_dtype = np.dtype([
+                ('bone_name', 'S32'),
+                ('flags', '<u4'),
+                ('frames', ANM_V3_FRAME_DTYPE, (anm_num_frames,)),
+            ])
+            track_records = rw.read_records(anm_track_dtype, anm_num_tracks)
+
+            bone_names = [bone_name.split(b'\0')[0].decode('ascii') for bone_name in track_records['bone_name'].tolist()]
+            track_frames = track_records['frames']
+            tracks = lol_anm_tracks_from_arrays(
+                bone_hashes = lol_elf_hash_array(bone_names),
+                positions = track_frames['pos'],
+                scales = np.ones(track_frames['pos'].shape, dtype = np.float32),
+                rotations = track_frames['rot'],
+            )
+            asset_name = os.path.splitext(os.path.basename(rw.name))[0]
 
             anm = LoLANM(
                 tracks = tracks,
                 tick_duration = 1.0 / anm_frame_frate,
+                asset_name = asset_name,
             )
             return anm
 
@@ -84,56 +411,29 @@ class LoLANM(NamedTuple):
 
             tracks = []
             if anm_num_tracks and anm_num_frames:
-                anm_frames = []
-                anm_num_vectors = 0
-                anm_num_quats = 0
-
                 with rw.seek_push(anm_off_frames):
-                    for _ in range(0, anm_num_tracks * anm_num_frames):
-                        frame_bone_hash = rw.read_u32()
-                        frame_pos_idx = rw.read_u16()
-                        frame_scale_idx = rw.read_u16()
-                        frame_rot_idx = rw.read_u16()
-                        frame_pad = rw.read_u16()
-                        anm_num_vectors = max(anm_num_vectors, frame_pos_idx + 1, frame_scale_idx + 1)
-                        anm_num_quats = max(anm_num_quats, frame_rot_idx + 1)
-                        frame = (frame_bone_hash, frame_pos_idx, frame_scale_idx, frame_rot_idx,)
-                        anm_frames.append(frame)
-
-                anm_vectors = []
+                    frame_records = rw.read_records(ANM_V4_FRAME_DTYPE, anm_num_tracks * anm_num_frames)
+                anm_num_vectors = int(max(frame_records['pos_idx'].max(), frame_records['scale_idx'].max())) + 1
+                anm_num_quats = int(frame_records['rot_idx'].max()) + 1
+
                 with rw.seek_push(anm_off_vectors):
-                    for _ in range(0, anm_num_vectors):
-                        vec = rw.read_vec3()
-                        anm_vectors.append(vec)
-                
-                anm_quats = []
+                    anm_vectors = rw.read_vec3_array(anm_num_vectors)
+
                 with rw.seek_push(anm_off_quats):
-                    for _ in range(0, anm_num_quats):
-                        quat = rw.read_quat()
-                        anm_quats.append(quat)
+                    anm_quats = rw.read_quat_array(anm_num_quats)
 
-                for track_idx in range(0, anm_num_tracks):
-                    bone_hash = None
-                    track_frames = []
-                    for frame_idx in range(0, anm_num_frames):
-                        idx = frame_idx * anm_num_tracks + track_idx
-                        frame_bone_hash, frame_pos_idx, frame_scale_idx, frame_rot_idx in anm_frames[idx]
-                        if bone_hash == None:
-                            bone_hash = frame_bone_hash
-                        else:
-                            assert(bone_hash == frame_bone_hash)
-                        frame_pos = anm_vectors[frame_pos_idx]
-                        frame_scale = anm_vectors[frame_scale_idx]
-                        frame_rot = anm_quats[frame_rot_idx]
-                        frame = LoLForm3D(pos = frame_pos, scale = frame_scale, rot = frame_rot)
-                        track_frames.append(frame)
-                    track = LoLANM.Track(
-                        frames = track_frames,
-                        bone_hash = bone_hash,
-                    )
-                    tracks.append(track)
-            if asset_name is '':
-                asset_name = os.path.splitext(os.path.basename(io_src.name))[0]
+                # Frame table is frame major, transpose to (tracks, frames)
+                frame_records = frame_records.reshape(anm_num_frames, anm_num_tracks).T
+                anm_bone_hashes = frame_records['bone_hash']
+                assert((anm_bone_hashes == anm_bone_hashes[:, :1]).all())
+                tracks = lol_anm_tracks_from_arrays(
+                    bone_hashes = anm_bone_hashes[:, 0],
+                    positions = anm_vectors[frame_records['pos_idx']],
+                    scales = anm_vectors[frame_records['scale_idx']],
+                    rotations = anm_quats[frame_records['rot_idx']],
+                )
+            if asset_name == '':
+                asset_name = os.path.splitext(os.path.basename(rw.name))[0]
 
             anm = LoLANM(
                 tracks = tracks,
@@ -168,56 +468,30 @@ class LoLANM(NamedTuple):
 
             tracks = []
             if anm_num_tracks and anm_num_frames:
-                anm_frames = []
-                anm_num_vectors = 0
-                anm_num_quats = 0
-
                 with rw.seek_push(anm_off_frames):
-                    for _ in range(0, anm_num_tracks * anm_num_frames):
-                        frame_pos_idx = rw.read_u16()
-                        frame_scale_idx = rw.read_u16()
-                        frame_rot_idx = rw.read_u16()
-                        anm_num_vectors = max(anm_num_vectors, frame_pos_idx + 1, frame_scale_idx + 1)
-                        anm_num_quats = max(anm_num_quats, frame_rot_idx + 1)
-                        frame = (frame_pos_idx, frame_scale_idx, frame_rot_idx,)
-                        anm_frames.append(frame)
-
-                anm_vectors = []
+                    frame_records = rw.read_records(ANM_V5_FRAME_DTYPE, anm_num_tracks * anm_num_frames)
+                anm_num_vectors = int(max(frame_records['pos_idx'].max(), frame_records['scale_idx'].max())) + 1
+                anm_num_quats = int(frame_records['rot_idx'].max()) + 1
+
                 with rw.seek_push(anm_off_vectors):
-                    for _ in range(0, anm_num_vectors):
-                        vec = rw.read_vec3()
-                        anm_vectors.append(vec)
-                
-                anm_quats = []
+                    anm_vectors = rw.read_vec3_array(anm_num_vectors)
+
                 with rw.seek_push(anm_off_quats):
-                    for _ in range(0, anm_num_quats):
-                        quat = rw.read_quat_quantized()
-                        anm_quats.append(quat)
+                    anm_quats = rw.read_quat_quantized_array(anm_num_quats)
 
-                anm_bone_hashes = []
                 with rw.seek_push(anm_off_bone_hashes):
-                    for _ in range(0, anm_num_tracks):
-                        bone_hash = rw.read_u32()
-                        anm_bone_hashes.append(bone_hash)
+                    anm_bone_hashes = rw.read_u32_array(anm_num_tracks)
 
-                for track_idx in range(0, anm_num_tracks):
-                    bone_hash = anm_bone_hashes[track_idx]
-                    track_frames = []
-                    for frame_idx in range(0, anm_num_frames):
-                        idx = frame_idx * anm_num_tracks + track_idx
-                        frame_pos_idx, frame_scale_idx, frame_rot_idx in anm_frames[idx]
-                        frame_pos = anm_vectors[frame_pos_idx]
-                        frame_scale = anm_vectors[frame_scale_idx]
-                        frame_rot = anm_quats[frame_rot_idx]
-                        frame = LoLForm3D(pos = frame_pos, scale = frame_scale, rot = frame_rot)
-                        track_frames.append(frame)
-                    track = LoLANM.Track(
-                        frames = track_frames,
-                        bone_hash = bone_hash,
-                    )
-                    tracks.append(track)
-            if asset_name is '':
-                asset_name = os.path.splitext(os.path.basename(io_src.name))[0]
+                # Frame table is frame major, transpose to (tracks, frames)
+                frame_records = frame_records.reshape(anm_num_frames, anm_num_tracks).T
+                tracks = lol_anm_tracks_from_arrays(
+                    bone_hashes = anm_bone_hashes,
+                    positions = anm_vectors[frame_records['pos_idx']],
+                    scales = anm_vectors[frame_records['scale_idx']],
+                    rotations = anm_quats[frame_records['rot_idx']],
+                )
+            if asset_name == '':
+                asset_name = os.path.splitext(os.path.basename(rw.name))[0]
             anm = LoLANM(
                 tracks = tracks,
                 tick_duration = anm_tick_duration,
@@ -252,70 +526,99 @@ class LoLANM(NamedTuple):
             anm_off_bone_hashes = rw.read_ptr(start)
 
             tracks = []
-            tracks_bone_hash = []
-            if anm_num_tracks and anm_num_frame_parts:
-                frame_parts = []
-
-                # Read raw tracks frames
-                with rw.seek_push(anm_off_frames):
-                    for _ in range(0, anm_num_frame_parts):
-                        time = rw.read_f32_pack16(anm_total_duration)
-                        #time = rw.read_u16()
-                        bits = rw.read_u16()
-                        indx = bits & 0x3FFF
-                        match bits & 0xC000:
-                            case 0x0000:
-                                v = rw.read_quat_quantized()
-                                frame_parts.append((indx, time, "rot", v))
-                            case 0x4000:
-                                v = rw.read_vec3_pack48(anm_pos_min, anm_pos_max)
-                                frame_parts.append((indx, time, "pos", v))
-                            case 0x8000:
-                                v = rw.read_vec3_pack48(anm_scale_min, anm_scale_max)
-                                frame_parts.append((indx, time, "scale", v))
-                            case _:
-                                raise ValueError(f'Bad compressed anm frame type: 3')
-
-                # Read bone hashes
+            if anm_num_tracks:
                 with rw.seek_push(anm_off_bone_hashes):
-                    for _ in range(0, anm_num_tracks):
-                        bone_hash = rw.read_u32()
-                        tracks_bone_hash.append(bone_hash)
-
-                if anm_off_jump_cache: # and full_read:
-                    # Used to construct "HotFrames", we don't care about it
-                    print("anm_total_duration", anm_total_duration)
-                    print("anm_fps", anm_fps)
+                    tracks_bone_hash = rw.read_u32_array(anm_num_tracks)
+
+                frame_parts = np.zeros(0, CANM_V1_FRAME_DTYPE)
+                if anm_num_frame_parts:
+                    with rw.seek_push(anm_off_frames):
+                        frame_parts = rw.read_records(CANM_V1_FRAME_DTYPE, anm_num_frame_parts)
+                part_kinds = frame_parts['bits'] >> 14
+                part_tracks = (frame_parts['bits'] & 0x3FFF).astype(np.intp)
+                if (part_kinds == 3).any():
+                    raise ValueError(f'Bad compressed anm frame type: 3')
+                if (part_tracks >= anm_num_tracks).any():
+                    raise ValueError(f'Compressed anm frame references track {part_tracks.max()} of {anm_num_tracks}!')
+                part_times = (frame_parts['time'] / 65535.0) * anm_total_duration
+
+                # Decode every value in its own channel's format
+                part_values = np.zeros((anm_num_frame_parts, 4), dtype = np.float64)
+                is_rot = part_kinds == 0
+                part_values[is_rot] = lol_quat_dequantize(frame_parts['data'][is_rot])
+                for kind, vec_min, vec_max in ((1, anm_pos_min, anm_pos_max), (2, anm_scale_min, anm_scale_max)):
+                    is_kind = part_kinds == kind
+                    vec_min = np.array(vec_min, dtype = np.float64)
+                    vec_max = np.array(vec_max, dtype = np.float64)
+                    part_values[is_kind, :3] = vec_min + (frame_parts['data'][is_kind] / 65535.0) * (vec_max - vec_min)
+
+                # Group parts into (track, channel) curves ordered by time
+                part_channels = part_tracks * 3 + part_kinds
+                order = np.lexsort((np.arange(anm_num_frame_parts), part_times, part_channels))
+                channel_starts = np.searchsorted(part_channels[order], np.arange(anm_num_tracks * 3 + 1))
+                part_keys = np.empty(anm_num_frame_parts, dtype = np.intp)
+                part_keys[order] = np.arange(anm_num_frame_parts) - channel_starts[part_channels[order]]
+
+                # Jump cache holds 4 hot frame part indices per channel and track,
+                # the second one is the key at or before the start of each span
+                jump_keys = None
+                jump_step = 0.0
+                if anm_off_jump_cache and anm_num_jump_caches:
                     with rw.seek_push(anm_off_jump_cache):
-                        for jump_indx in range(0, anm_num_jump_caches):
-                            print("jump_indx", jump_indx)
-                            for track_indx in range(0, anm_num_tracks):
-                                print("\t", "track_indx", track_indx, hex(tracks_bone_hash[track_indx]))
-                                indices = []
-                                if anm_num_frame_parts <= 0x10000:
-                                    for _ in range(0, 4 * 3):
-                                        indices.append(rw.read_u16())
-                                else:
-                                    for _ in range(0, 4 * 3):
-                                        indices.append(rw.read_u32())
-                                cursor = max(indices)
-                                t = [ frame_parts[i][1] for i in indices[4:8] ]
-                                x = [ frame_parts[i][3].x for i in indices[4:8] ]
-                                print("\t\t", f"t = {t!r}")
-                                print("\t\t", f"x = {x!r}")
-
-                                for i in indices[0:4]:
-                                    assert(frame_parts[i][2] == "rot")
-                                for i in indices[4:8]:
-                                    assert(frame_parts[i][2] == "pos")
-                                for i in indices[8:12]:
-                                    assert(frame_parts[i][2] == "scale")
+                        if anm_num_frame_parts <= 0x10000:
+                            jump_parts = rw.read_u16_array(anm_num_jump_caches * anm_num_tracks * 12)
+                        else:
+                            jump_parts = rw.read_u32_array(anm_num_jump_caches * anm_num_tracks * 12)
+                    jump_parts = jump_parts.reshape(anm_num_jump_caches, anm_num_tracks, 3, 4).astype(np.intp)
+                    jump_parts = np.minimum(jump_parts, max(anm_num_frame_parts - 1, 0))
+                    if anm_num_frame_parts:
+                        jump_keys = part_keys[jump_parts[:, :, :, 1]]
+                    jump_step = anm_total_duration / anm_num_jump_caches
+
+                default_values = (np.array([0.0, 0.0, 0.0, 1.0]), np.zeros(3), np.ones(3))
+                anm_num_frames = int(round(anm_total_duration * anm_fps)) + 1
+                frame_times = np.minimum(np.arange(anm_num_frames) / anm_fps, anm_total_duration)
+                curves = []
+                samples = []
+                for track_idx in range(0, anm_num_tracks):
+                    track_curves = []
+                    track_samples = []
+                    for kind in range(0, 3):
+                        channel = track_idx * 3 + kind
+                        keys = order[channel_starts[channel]:channel_starts[channel + 1]]
+                        size = 4 if kind == 0 else 3
+                        times = part_times[keys]
+                        values = part_values[keys, :size]
+                        if not len(keys):
+                            times = np.zeros(1)
+                            values = default_values[kind][None, :]
+                        curve = LoLANM.Curve(
+                            times = times,
+                            values = values,
+                            is_rotation = kind == 0,
+                            jump_keys = jump_keys[:, track_idx, kind] if jump_keys is not None and len(keys) else None,
+                            jump_step = jump_step,
+                        )
+                        track_curves.append(curve)
+                        track_samples.append(curve.sample(frame_times))
+                    curves.append(track_curves)
+                    samples.append(track_samples)
+
+                tracks = lol_anm_tracks_from_arrays(
+                    bone_hashes = tracks_bone_hash,
+                    positions = np.array([track_samples[1] for track_samples in samples]),
+                    scales = np.array([track_samples[2] for track_samples in samples]),
+                    rotations = np.array([track_samples[0] for track_samples in samples]),
+                    curves = curves,
+                )
+
+            asset_name = os.path.splitext(os.path.basename(rw.name))[0]
 
             anm = LoLANM(
                 tracks = tracks,
                 tick_duration = 1 / anm_fps,
                 flags = anm_flags,
-                asset_name = "",
+                asset_name = asset_name,
             )
             return anm
 
@@ -330,3 +633,458 @@ class LoLANM(NamedTuple):
         else:
             raise ValueError(f'Unsupported LoLANM with magic = {repr(magic)} and version = {version:#08X}!')
 
+    def write(self, io_dst: IO, tolerance: float = 0.0):
+        """Write as r3d2anmd v5.
+
+        Positions and scales share one vector pool, rotations are pooled after quantization.
+        With a tolerance, components are snapped to a grid of that size and values landing
+        in the same cell are merged.
+        """
+        rw = LoLBuilderIO()
+        rw.write_bytes(b'r3d2anmd')
+        rw.write_u32(5)
+
+        anm_num_tracks = len(self.tracks)
+        anm_num_frames = self.tracks[0].frame_count if anm_num_tracks else 0
+        assert(all(track.frame_count == anm_num_frames for track in self.tracks))
+
+        def vector_keys(values: np.ndarray) -> np.ndarray:
+            if tolerance > 0.0:
+                return np.floor(values / tolerance + 0.5).astype(np.int64)
+            return values.view(np.uint32)
+
+        def quat_keys(words: np.ndarray) -> np.ndarray:
+            if tolerance > 0.0:
+                return np.floor(lol_quat_dequantize(words) / tolerance + 0.5).astype(np.int64)
+            return words
+
+        # Pool indices of every track, filled one track at a time
+        vector_pool = LoLANM.Pool()
+        quat_pool = LoLANM.Pool()
+        frame_records = np.zeros((anm_num_tracks, anm_num_frames), ANM_V5_FRAME_DTYPE)
+        for track_idx, track in enumerate(self.tracks):
+            frame_records['pos_idx'][track_idx] = vector_pool.add(track.positions, vector_keys(track.positions))
+            frame_records['scale_idx'][track_idx] = vector_pool.add(track.scales, vector_keys(track.scales))
+            quat_words = lol_quat_quantize(track.rotations)
+            frame_records['rot_idx'][track_idx] = quat_pool.add(quat_words, quat_keys(quat_words))
+        if len(vector_pool) > 0x10000 or len(quat_pool) > 0x10000:
+            raise ValueError(f'LoLANM pools too large for 16 bit indices ({len(vector_pool)} vectors, {len(quat_pool)} quaternions)!')
+
+        start = rw.tell()
+
+        anm_magic = 0
+        anm_version = 0
+        anm_ext = (0, 0, 0,)
+
+        slot_size = rw.reserve_u32()
+        rw.write_u32(anm_magic)
+        rw.write_u32(anm_version)
+        rw.write_u32(self.flags)
+        rw.write_u32(anm_num_tracks)
+        rw.write_u32(anm_num_frames)
+        rw.write_f32(self.tick_duration)
+        slot_off_bone_hashes = rw.reserve_ptr()
+        # NOTE: like the game files no asset name is stored, the reader falls back to the file name
+        rw.write_i32(0) # asset name offset
+        rw.write_i32(0) # time offset, unused by v5
+        slot_off_vectors = rw.reserve_ptr()
+        slot_off_quats = rw.reserve_ptr()
+        slot_off_frames = rw.reserve_ptr()
+        for ext in anm_ext:
+            rw.write_u32(ext)
+
+        anm_off_vectors = rw.tell()
+        rw.write_vec3_array(np.array(vector_pool.values, dtype = np.float32).reshape(-1, 3))
+
+        anm_off_quats = rw.tell()
+        rw.write_u16_array(np.array(quat_pool.values, dtype = np.uint16).reshape(-1, 3))
+        rw.write_align(4)
+
+        anm_off_bone_hashes = rw.tell()
+        rw.write_u32_array([track.bone_hash for track in self.tracks])
+
+        # Frame table is frame major
+        anm_off_frames = rw.tell()
+        rw.write_records(frame_records.T)
+
+        anm_size = rw.tell() - start
+
+        rw.patch_u32(slot_size, anm_size)
+        rw.patch_ptr(slot_off_bone_hashes, anm_off_bone_hashes, start)
+        rw.patch_ptr(slot_off_vectors, anm_off_vectors, start)
+        rw.patch_ptr(slot_off_quats, anm_off_quats, start)
+        rw.patch_ptr(slot_off_frames, anm_off_frames, start)
+        rw.write_to(io_dst)
+
+    def write_compressed(self, io_dst: IO,
+            rot_error_margin: float = 0.002, pos_error_margin: float = 0.01, scale_error_margin: float = 0.001,
+            rot_discontinuity_threshold: float = 0.0, pos_discontinuity_threshold: float = 0.0,
+            scale_discontinuity_threshold: float = 0.0, jump_cache_count: Optional[int] = None):
+        """Write as r3d2canm v1.
+
+        Every channel keeps only the frames needed to stay within its error margin (radians for
+        rotations, units for positions and scales) when the reader interpolates it at every frame time.
+        Positions and scales are packed over the range of the whole animation, a frame whose own pack48
+        or quaternion quantization error is larger than the margin stays within that error instead.
+        Frames on either side of a jump larger than a non zero discontinuity threshold are always kept.
+        """
+        rw = LoLBuilderIO()
+        rw.write_bytes(b'r3d2canm')
+        rw.write_u32(1)
+
+        anm_num_tracks = len(self.tracks)
+        anm_num_frames = self.tracks[0].frame_count if anm_num_tracks else 0
+        assert(all(track.frame_count == anm_num_frames for track in self.tracks))
+        if anm_num_tracks > 0x4000:
+            raise ValueError(f'LoLANM has {anm_num_tracks} tracks, compressed anm supports at most {0x4000}!')
+
+        # Work with the float32 values the reader will see
+        anm_fps = float(np.float32(1.0 / self.tick_duration))
+        anm_total_duration = float(np.float32(max(anm_num_frames - 1, 0) / anm_fps))
+        if jump_cache_count == None:
+            jump_cache_count = max(1, math.ceil(anm_total_duration * 4))
+
+        positions = np.array([track.positions for track in self.tracks], dtype = np.float64).reshape(anm_num_tracks, anm_num_frames, 3)
+        scales = np.array([track.scales for track in self.tracks], dtype = np.float64).reshape(anm_num_tracks, anm_num_frames, 3)
+        rotations = np.array([track.rotations for track in self.tracks], dtype = np.float64).reshape(anm_num_tracks, anm_num_frames, 4)
+        rotations /= np.linalg.norm(rotations, axis = -1, keepdims = True)
+
+        # Quantize everything up front, keys are chosen by what the reader will decode
+        def pack48(values: np.ndarray):
+            vec_min = values.reshape(-1, 3).min(axis = 0) if values.size else np.zeros(3)
+            vec_max = values.reshape(-1, 3).max(axis = 0) if values.size else np.zeros(3)
+            vec_min = vec_min.astype(np.float32).astype(np.float64)
+            vec_max = vec_max.astype(np.float32).astype(np.float64)
+            vec_range = np.where(vec_max > vec_min, vec_max - vec_min, 1.0)
+            data = np.clip(np.rint((values - vec_min) / vec_range * 65535.0), 0, 65535).astype(np.uint16)
+            decoded = vec_min + (data / 65535.0) * (vec_max - vec_min)
+            return data, decoded, vec_min, vec_max
+        pos_data, pos_decoded, anm_pos_min, anm_pos_max = pack48(positions)
+        scale_data, scale_decoded, anm_scale_min, anm_scale_max = pack48(scales)
+        rot_data = lol_quat_quantize(rotations).reshape(anm_num_tracks, anm_num_frames, 3)
+        rot_decoded = lol_quat_dequantize(rot_data).reshape(anm_num_tracks, anm_num_frames, 4)
+
+        sample_times = np.minimum(np.arange(anm_num_frames) / anm_fps, anm_total_duration)
+        time_data = np.zeros(anm_num_frames, dtype = np.uint16)
+        if anm_total_duration > 0.0:
+            time_data = np.rint(sample_times / anm_total_duration * 65535.0).astype(np.uint16)
+        key_times = (time_data / 65535.0) * anm_total_duration
+
+        # (time, bits, data) of every kept key, channel by channel
+        channels = (
+            (rotations, rot_decoded, rot_data, rot_error_margin, rot_discontinuity_threshold),
+            (positions, pos_decoded, pos_data, pos_error_margin, pos_discontinuity_threshold),
+            (scales, scale_decoded, scale_data, scale_error_margin, scale_discontinuity_threshold),
+        )
+        part_channels = []
+        part_frames = []
+        part_time_data = []
+        for kind, (values, decoded, data, error_margin, discontinuity_threshold) in enumerate(channels):
+            key_tracks, key_frames = lol_anm_reduce_keys(values, decoded, key_times, sample_times,
+                error_margin, kind == 0, discontinuity_threshold)
+            key_tracks, key_frames, key_time_data = lol_anm_place_keys(values, decoded, key_tracks, key_frames,
+                sample_times, anm_total_duration, error_margin, kind == 0)
+            part_channels.append(key_tracks * 3 + kind)
+            part_frames.append(key_frames)
+            part_time_data.append(key_time_data)
+        part_channels = np.concatenate(part_channels)
+        part_frames = np.concatenate(part_frames)
+        part_time_data = np.concatenate(part_time_data)
+
+        # Frame parts are stored by time
+        order = np.lexsort((part_channels, part_time_data))
+        part_channels = part_channels[order]
+        part_frames = part_frames[order]
+        part_time_data = part_time_data[order]
+        part_tracks = part_channels // 3
+        part_kinds = part_channels % 3
+        anm_num_frame_parts = len(order)
+
+        frame_parts = np.zeros(anm_num_frame_parts, CANM_V1_FRAME_DTYPE)
+        frame_parts['time'] = part_time_data
+        frame_parts['bits'] = (part_kinds << 14) | part_tracks
+        for kind, (_, _, data, _, _) in enumerate(channels):
+            is_kind = part_kinds == kind
+            frame_parts['data'][is_kind] = data[part_tracks[is_kind], part_frames[is_kind]]
+
+        # Jump cache: part indices of the keys around the start of every span, see read_canm_v1
+        jump_step = anm_total_duration / jump_cache_count
+        jump_times = np.arange(jump_cache_count) * jump_step
+        jump_parts = np.zeros((jump_cache_count, anm_num_tracks, 3, 4), dtype = np.int64)
+        channel_parts = np.argsort(part_channels, kind = 'stable')
+        channel_starts = np.searchsorted(part_channels[channel_parts], np.arange(anm_num_tracks * 3 + 1))
+        for channel in range(0, anm_num_tracks * 3):
+            parts = channel_parts[channel_starts[channel]:channel_starts[channel + 1]]
+            keys = np.searchsorted((part_time_data[parts] / 65535.0) * anm_total_duration, jump_times, side = 'right') - 1
+            hot = np.clip(keys[:, None] + np.arange(-1, 3), 0, len(parts) - 1)
+            jump_parts[:, channel // 3, channel % 3] = parts[hot]
+
+        start = rw.tell()
+
+        anm_magic = 0
+
+        slot_size = rw.reserve_u32()
+        rw.write_u32(anm_magic)
+        rw.write_u32(self.flags)
+        rw.write_u32(anm_num_tracks)
+        rw.write_u32(anm_num_frame_parts)
+        rw.write_u32(jump_cache_count)
+        rw.write_f32(anm_total_duration)
+        rw.write_f32(anm_fps)
+        rw.write_f32(rot_error_margin)
+        rw.write_f32(rot_discontinuity_threshold)
+        rw.write_f32(pos_error_margin)
+        rw.write_f32(pos_discontinuity_threshold)
+        rw.write_f32(scale_error_margin)
+        rw.write_f32(scale_discontinuity_threshold)
+        rw.write_vec3(LoLVec3(*anm_pos_min.tolist()))
+        rw.write_vec3(LoLVec3(*anm_pos_max.tolist()))
+        rw.write_vec3(LoLVec3(*anm_scale_min.tolist()))
+        rw.write_vec3(LoLVec3(*anm_scale_max.tolist()))
+        slot_off_frames = rw.reserve_ptr()
+        slot_off_jump_cache = rw.reserve_ptr()
+        slot_off_bone_hashes = rw.reserve_ptr()
+
+        anm_off_frames = rw.tell()
+        rw.write_records(frame_parts)
+        rw.write_align(4)
+
+        anm_off_jump_cache = rw.tell()
+        if anm_num_frame_parts <= 0x10000:
+            rw.write_u16_array(jump_parts)
+        else:
+            rw.write_u32_array(jump_parts)
+        rw.write_align(4)
+
+        anm_off_bone_hashes = rw.tell()
+        rw.write_u32_array([track.bone_hash for track in self.tracks])
+
+        anm_size = rw.tell() - start
+
+        rw.patch_u32(slot_size, anm_size)
+        rw.patch_ptr(slot_off_frames, anm_off_frames, start)
+        rw.patch_ptr(slot_off_jump_cache, anm_off_jump_cache, start)
+        rw.patch_ptr(slot_off_bone_hashes, anm_off_bone_hashes, start)
+        rw.write_to(io_dst)
+
+def lol_anm_interpolate(a: np.ndarray, b: np.ndarray, alpha: np.ndarray, is_rotation: bool, slerp = False) -> np.ndarray:
+    """Blend (N, C) values a and b by (N,) alpha, lerp for vectors and nlerp/slerp for quaternions."""
+    alpha = alpha[:, None]
+    if not is_rotation:
+        return a + (b - a) * alpha
+    # Take the shortest path
+    dot = np.sum(a * b, axis = 1, keepdims = True)
+    b = np.where(dot < 0.0, -b, b)
+    dot = np.abs(dot)
+    if slerp:
+        theta = np.arccos(np.minimum(dot, 1.0))
+        sin_theta = np.sin(theta)
+        use_slerp = sin_theta > 1e-6
+        safe_sin = np.where(use_slerp, sin_theta, 1.0)
+        wa = np.where(use_slerp, np.sin((1.0 - alpha) * theta) / safe_sin, 1.0 - alpha)
+        wb = np.where(use_slerp, np.sin(alpha * theta) / safe_sin, alpha)
+        result = a * wa + b * wb
+    else:
+        result = a + (b - a) * alpha
+    return result / np.linalg.norm(result, axis = 1, keepdims = True)
+
+def lol_anm_tracks_from_arrays(bone_hashes: np.ndarray, positions: np.ndarray, scales: np.ndarray, rotations: np.ndarray,
+        curves: Optional[List[List[LoLANM.Curve]]] = None) -> List[LoLANM.Track]:
+    """Build tracks from dense (tracks, frames, 3 | 4) position, scale and rotation arrays.
+
+    The arrays are converted to float32 once, every track then holds contiguous views into them.
+    """
+    positions = np.ascontiguousarray(positions, dtype = np.float32)
+    scales = np.ascontiguousarray(scales, dtype = np.float32)
+    rotations = np.ascontiguousarray(rotations, dtype = np.float32)
+    tracks = []
+    for track_idx, bone_hash in enumerate(np.asarray(bone_hashes).tolist()):
+        rot_curve, pos_curve, scale_curve = curves[track_idx] if curves != None else (None, None, None)
+        track = LoLANM.Track(
+            bone_hash = bone_hash,
+            positions = positions[track_idx],
+            scales = scales[track_idx],
+            rotations = rotations[track_idx],
+            rot_curve = rot_curve,
+            pos_curve = pos_curve,
+            scale_curve = scale_curve,
+        )
+        tracks.append(track)
+    return tracks
+
+def lol_anm_reduce_keys(values: np.ndarray, decoded: np.ndarray, key_times: np.ndarray, sample_times: np.ndarray,
+        error_margin: float, is_rotation: bool, discontinuity_threshold: float = 0.0) -> Tuple[np.ndarray, np.ndarray]:
+    """Greedily pick the frames to keep as keys for (curves, frames, 3 | 4) channel values.
+
+    Each segment is grown as far as interpolating its decoded end keys stays within error_margin
+    of the original values at every frame in between, searching exponentially then by bisection.
+    All curves advance in lockstep so every search step is one vectorized evaluation.
+    Returns (curve indices, frame indices) of the kept keys, sorted by curve then frame.
+    """
+    curve_count, frame_count = values.shape[0], values.shape[1]
+    if frame_count < 2 or curve_count == 0:
+        return np.repeat(np.arange(curve_count), frame_count), np.tile(np.arange(frame_count), curve_count)
+
+    def error(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        if is_rotation:
+            return 2.0 * np.arccos(np.minimum(np.abs(np.sum(a * b, axis = -1)), 1.0))
+        return np.linalg.norm(a - b, axis = -1)
+
+    def fits(curves: np.ndarray, first: np.ndarray, last: np.ndarray) -> np.ndarray:
+        # Ragged evaluation of the frames strictly inside every (first, last) segment
+        counts = np.maximum(last - first - 1, 0)
+        result = np.ones(len(curves), dtype = bool)
+        checked = counts > 0
+        if not checked.any():
+            return result
+        curves, first, last, counts = curves[checked], first[checked], last[checked], counts[checked]
+        offsets = np.cumsum(counts) - counts
+        inner = np.arange(counts.sum()) - np.repeat(offsets, counts)
+        frame_curves = np.repeat(curves, counts)
+        frame_first = np.repeat(first, counts)
+        frame_last = np.repeat(last, counts)
+        frames = frame_first + 1 + inner
+        span = np.maximum(key_times[frame_last] - key_times[frame_first], 1e-12)
+        alpha = np.clip((sample_times[frames] - key_times[frame_first]) / span, 0.0, 1.0)
+        blended = lol_anm_interpolate(decoded[frame_curves, frame_first], decoded[frame_curves, frame_last], alpha, is_rotation)
+        errors = error(blended, values[frame_curves, frames])
+        result[checked] = np.maximum.reduceat(errors, offsets) <= error_margin
+        return result
+
+    # Both sides of a discontinuity are kept, segments never span one
+    forced = np.zeros((curve_count, frame_count), dtype = bool)
+    forced[:, -1] = True
+    if discontinuity_threshold > 0.0:
+        jumps = error(values[:, :-1], values[:, 1:]) > discontinuity_threshold
+        forced[:, :-1] |= jumps
+        forced[:, 1:] |= jumps
+    # next_forced[c, f] is the first forced frame after f
+    next_forced = np.where(forced, np.arange(frame_count), frame_count - 1)
+    next_forced = np.minimum.accumulate(next_forced[:, ::-1], axis = 1)[:, ::-1]
+    next_forced = np.concatenate((next_forced[:, 1:], next_forced[:, -1:]), axis = 1)
+
+    # Search state per curve: 0 tries the whole span (first segment only, catches static curves),
+    # 1 grows by doubling, 2 bisects, 3 tries the limit once doubling reaches it
+    curves = np.arange(curve_count)
+    first = np.zeros(curve_count, dtype = np.intp)
+    limit = next_forced[:, 0].copy()
+    phase = np.zeros(curve_count, dtype = np.int8)
+    good = first + 1
+    bad = limit.copy()
+    step = np.full(curve_count, 2, dtype = np.intp)
+
+    key_curves = [curves]
+    key_frames = [first.copy()]
+    active = first < frame_count - 1
+    while active.any():
+        # Doubling past the limit tries the limit itself before bisecting against it
+        overshoot = active & (phase == 1) & (first + step >= limit)
+        phase[overshoot] = 3
+
+        # Bisection is done, keep the last frame known to fit
+        accept = active & (phase == 2) & (bad - good <= 1)
+        end = np.where(accept, good, -1)
+
+        candidate = np.where((phase == 0) | (phase == 3), limit, np.where(phase == 1, first + step, (good + bad) // 2))
+        evaluate = active & ~accept
+        ok = np.zeros(curve_count, dtype = bool)
+        ok[evaluate] = fits(curves[evaluate], first[evaluate], candidate[evaluate])
+
+        whole = evaluate & ((phase == 0) | (phase == 3))
+        end = np.where(whole & ok, limit, end)
+        grow = whole & ~ok & (phase == 0)
+        phase[grow] = 1
+        good[grow] = first[grow] + 1
+        step[grow] = 2
+        shrink = whole & ~ok & (phase == 3)
+        phase[shrink] = 2
+        bad[shrink] = limit[shrink]
+
+        doubling = evaluate & (phase == 1) & ~grow
+        good = np.where(doubling & ok, candidate, good)
+        step = np.where(doubling & ok, step * 2, step)
+        bad = np.where(doubling & ~ok, candidate, bad)
+        phase[doubling & ~ok] = 2
+
+        bisecting = evaluate & (phase == 2) & ~doubling & ~shrink
+        good = np.where(bisecting & ok, candidate, good)
+        bad = np.where(bisecting & ~ok, candidate, bad)
+
+        # Start the next segment from every newly kept key
+        done = end > -1
+        if done.any():
+            key_curves.append(curves[done])
+            key_frames.append(end[done])
+            first[done] = end[done]
+            limit[done] = next_forced[done, end[done]]
+            phase[done] = 1
+            good[done] = end[done] + 1
+            step[done] = 2
+            active = first < frame_count - 1
+
+    key_curves = np.concatenate(key_curves)
+    key_frames = np.concatenate(key_frames)
+    order = np.lexsort((key_frames, key_curves))
+    return key_curves[order], key_frames[order]
+
+def lol_anm_place_keys(values: np.ndarray, decoded: np.ndarray, key_curves: np.ndarray, key_frames: np.ndarray,
+        sample_times: np.ndarray, duration: float, error_margin: float, is_rotation: bool) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Pick the u16 times of the keys chosen by lol_anm_reduce_keys.
+
+    Keys are stored at the representable time nearest to their frame, so the reader evaluates a
+    kept frame a little before or after its key. Across a large jump between frames that alone
+    can break the error margin. Every frame is decoded like the reader does, and a frame that is
+    off by more than max(error_margin, its own quantization error) is stored at both neighbouring
+    u16 times, which makes it decode exactly. Returns (curve indices, frame indices, u16 times).
+    """
+    curve_count, frame_count = values.shape[0], values.shape[1]
+    exact = np.zeros(frame_count)
+    if duration > 0.0:
+        exact = np.clip(sample_times / duration * 65535.0, 0.0, 65535.0)
+    time_nearest = np.rint(exact).astype(np.int64)
+    time_before = np.floor(exact).astype(np.int64)
+    time_after = np.ceil(exact).astype(np.int64)
+
+    def error(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        if is_rotation:
+            return 2.0 * np.arccos(np.minimum(np.abs(np.sum(a * b, axis = -1)), 1.0))
+        return np.linalg.norm(a - b, axis = -1)
+
+    # Interpolating between two equal keys still rounds a little, mostly in arccos
+    allowed = np.maximum(error_margin, error(decoded, values)) + (1e-6 if is_rotation else 1e-9)
+    kept = np.zeros((curve_count, frame_count), dtype = bool)
+    kept[key_curves, key_frames] = True
+    doubled = np.zeros((curve_count, frame_count), dtype = bool)
+    frame_indices = np.arange(frame_count)
+    while True:
+        # Keys of all curves sorted by (curve, time), doubled frames once before and once after
+        single = kept & ~doubled
+        curves = np.concatenate((np.nonzero(single)[0], np.nonzero(doubled)[0], np.nonzero(doubled)[0]))
+        frames = np.concatenate((np.nonzero(single)[1], np.nonzero(doubled)[1], np.nonzero(doubled)[1]))
+        times = np.concatenate((time_nearest[np.nonzero(single)[1]], time_before[np.nonzero(doubled)[1]], time_after[np.nonzero(doubled)[1]]))
+        unique = np.unique(np.stack((curves, times, frames), axis = 1), axis = 0)
+        # Equal times of one frame collapse into one key
+        unique = unique[np.concatenate(([True], (unique[1:, 0] != unique[:-1, 0]) | (unique[1:, 1] != unique[:-1, 1])))]
+        curves, times, frames = unique[:, 0], unique[:, 1], unique[:, 2]
+        if duration <= 0.0:
+            return curves, frames, times.astype(np.uint16)
+
+        # Decode every frame of every curve the way LoLANM.Curve.sample does
+        curve_starts = np.searchsorted(curves, np.arange(curve_count + 1))
+        combined = curves * 65536.0 + times
+        sample_curves = np.repeat(np.arange(curve_count), frame_count)
+        sample_frames = np.tile(frame_indices, curve_count)
+        keys = np.searchsorted(combined, sample_curves * 65536.0 + exact[sample_frames], side = 'right') - 1
+        keys = np.clip(keys, curve_starts[sample_curves], curve_starts[sample_curves + 1] - 1)
+        next_keys = np.minimum(keys + 1, curve_starts[sample_curves + 1] - 1)
+        key_seconds = (times / 65535.0) * duration
+        t0, t1 = key_seconds[keys], key_seconds[next_keys]
+        span = np.where(t1 > t0, t1 - t0, 1.0)
+        alpha = np.clip((sample_times[sample_frames] - t0) / span, 0.0, 1.0)
+        evaluated = lol_anm_interpolate(decoded[curves[keys], frames[keys]], decoded[curves[next_keys], frames[next_keys]], alpha, is_rotation)
+        bad = (error(evaluated, values[sample_curves, sample_frames]) > allowed[sample_curves, sample_frames]).reshape(curve_count, frame_count)
+        if not bad.any():
+            return curves, frames, times.astype(np.uint16)
+        # Frames that are off become keys, keys that are still off are doubled
+        doubled |= bad & kept
+        kept |= bad
@@ -0,0 +1,115 @@
+from __future__ import annotations
+from typing import Optional
+import numpy as np
+from .anm_io_imp import LoLANM, lol_anm_interpolate
+
+# Channel layout of sampled poses, same order as LoLForm3D
+POS = slice(0, 3)
+SCALE = slice(3, 6)
+ROT = slice(6, 10)
+
+class LoLANMSampler:
+    """Evaluates every track of a LoLANM at arbitrary times in one call.
+
+    Positions and scales are lerped, rotations nlerped (or slerped). Dense
+    v3/v4/v5 tracks are sampled from their frames, compressed tracks from
+    their sparse curves. The last bracketing key of every curve is cached so
+    sequential playback only searches forward from where it left off.
+    """
+
+    __slots__ = ('anm', 'slerp', 'dense_tracks_', 'dense_frames_', 'curve_tracks_', 'cursors_')
+
+    def __init__(self, anm: LoLANM, slerp = False):
+        self.anm = anm
+        self.slerp = slerp
+
+        curve_tracks = []
+        dense_tracks = []
+        for track_idx, track in enumerate(anm.tracks):
+            if track.rot_curve != None and track.pos_curve != None and track.scale_curve != None:
+                curve_tracks.append(track_idx)
+            else:
+                dense_tracks.append(track_idx)
+        self.curve_tracks_ = np.array(curve_tracks, dtype = np.intp)
+        self.dense_tracks_ = np.array(dense_tracks, dtype = np.intp)
+
+        # (tracks, frames, 10)
+        self.dense_frames_ = np.zeros((0, 0, 10), dtype = np.float32)
+        if len(dense_tracks):
+            self.dense_frames_ = np.stack([
+                np.concatenate((track.positions, track.scales, track.rotations), axis = 1)
+                for track in (anm.tracks[track_idx] for track_idx in dense_tracks)
+            ])
+
+        self.cursors_ = np.zeros((len(curve_tracks), 3), dtype = np.intp)
+
+    @property
+    def duration(self) -> float:
+        frame_count = max((track.frame_count for track in self.anm.tracks), default = 0)
+        return max(frame_count - 1, 0) * self.anm.tick_duration
+
+    def reset(self):
+        self.cursors_[:] = 0
+
+    def sample(self, times: np.ndarray) -> np.ndarray:
+        """Sample all tracks at times (seconds), returns a (times, tracks, 10) float32 array."""
+        times = np.atleast_1d(np.asarray(times, dtype = np.float64))
+        poses = np.empty((len(times), len(self.anm.tracks), 10), dtype = np.float32)
+        if len(self.dense_tracks_):
+            poses[:, self.dense_tracks_] = self._sample_dense(times)
+        if len(self.curve_tracks_):
+            poses[:, self.curve_tracks_] = self._sample_curves(times)
+        return poses
+
+    def sample_fps(self, fps: float, start: float = 0.0, end: Optional[float] = None) -> np.ndarray:
+        """Resample the whole animation (or [start, end]) at a different frame rate."""
+        if end == None:
+            end = self.duration
+        count = int(np.floor((end - start) * fps + 1e-6)) + 1
+        return self.sample(start + np.arange(count) / fps)
+
+    def _sample_dense(self, times: np.ndarray) -> np.ndarray:
+        frames = self.dense_frames_
+        track_count, frame_count = frames.shape[0], frames.shape[1]
+        if frame_count == 0:
+            poses = np.zeros((len(times), track_count, 10), dtype = np.float32)
+            poses[:, :, SCALE] = 1.0
+            poses[:, :, 9] = 1.0
+            return poses
+        position = np.clip(times / self.anm.tick_duration, 0.0, frame_count - 1)
+        keys = position.astype(np.intp)
+        next_keys = np.minimum(keys + 1, frame_count - 1)
+        alpha = np.clip(position - keys, 0.0, 1.0)
+        # (tracks, times, 10) -> (tracks * times, 10) so all tracks blend in one go
+        a = frames[:, keys].reshape(-1, 10).astype(np.float64)
+        b = frames[:, next_keys].reshape(-1, 10).astype(np.float64)
+        alpha = np.tile(alpha, track_count)
+        return self._blend(a, b, alpha).reshape(track_count, len(times), 10).transpose(1, 0, 2)
+
+    def _sample_curves(self, times: np.ndarray) -> np.ndarray:
+        poses = np.empty((len(times), len(self.curve_tracks_), 10), dtype = np.float32)
+        first_time = times.min()
+        last_time_idx = int(np.argmax(times))
+        for i, track_idx in enumerate(self.curve_tracks_.tolist()):
+            track = self.anm.tracks[track_idx]
+            for kind, (curve, channel) in enumerate(((track.rot_curve, ROT), (track.pos_curve, POS), (track.scale_curve, SCALE))):
+                curve_times = curve.times
+                # Only search forward from the cached key when playback moved forward
+                start = int(self.cursors_[i, kind])
+                if curve_times[start] > first_time:
+                    start = curve.seek(first_time)
+                keys = start + np.searchsorted(curve_times[start:], times, side = 'right') - 1
+                keys = np.clip(keys, 0, len(curve_times) - 1)
+                self.cursors_[i, kind] = keys[last_time_idx]
+                next_keys = np.minimum(keys + 1, len(curve_times) - 1)
+                t0, t1 = curve_times[keys], curve_times[next_keys]
+                span = np.where(t1 > t0, t1 - t0, 1.0)
+                alpha = np.clip((times - t0) / span, 0.0, 1.0)
+                poses[:, i, channel] = lol_anm_interpolate(curve.values[keys], curve.values[next_keys], alpha, kind == 0, self.slerp)
+        return poses
+
+    def _blend(self, a: np.ndarray, b: np.ndarray, alpha: np.ndarray) -> np.ndarray:
+        result = np.empty_like(a)
+        result[:, 0:6] = lol_anm_interpolate(a[:, 0:6], b[:, 0:6], alpha, False)
+        result[:, ROT] = lol_anm_interpolate(a[:, ROT], b[:, ROT], alpha, True, self.slerp)
+        return result
@@ -0,0 +1,313 @@
+from __future__ import annotations
+from typing import NamedTuple, Any, Callable, Dict, Tuple, Union
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import shutil
+import uuid
+import numpy as np
+from ..helper.io_helper import LoLBufferIO, LoLBox, LoLForm3D, LoLSphere, LoLVec3
+from .skn_io_imp import LoLSKN
+from .skl_io_imp import LoLSKL
+from .anm_io_imp import LoLANM, lol_anm_tracks_from_arrays
+
+# Bump when a reader or the entry layout changes so older entries are never loaded
+ASSET_CACHE_VERSION = 1
+
+def lol_file_digest(path: str) -> str:
+    """BLAKE2b hex digest of a file's content."""
+    digest = hashlib.blake2b(digest_size = 20)
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _skn_encode(skn: LoLSKN) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    arrays = skn.get_vertex_arrays()._asdict()
+    if arrays['colors'] is None:
+        del arrays['colors']
+    arrays['indices'] = np.asarray(skn.indices, dtype = np.uint16)
+    meta_data = None
+    if skn.meta_data != None:
+        box, sphere = skn.meta_data.bound_box, skn.meta_data.bound_sphere
+        meta_data = [list(box.start) + list(box.end), list(sphere.center) + [sphere.radius], skn.meta_data.has_color, skn.meta_data.flags]
+    meta = {
+        'meshes': [list(mesh) for mesh in skn.meshes],
+        'pivot_point': list(skn.pivot_point) if skn.pivot_point != None else None,
+        'meta_data': meta_data,
+    }
+    return arrays, meta
+
+def _skn_decode(arrays: Dict[str, np.ndarray], meta: Dict[str, Any]) -> LoLSKN:
+    vertex_arrays = LoLSKN.VertexArrays(
+        positions = arrays['positions'],
+        blend_indices = arrays['blend_indices'],
+        blend_weights = arrays['blend_weights'],
+        normals = arrays['normals'],
+        uvs = arrays['uvs'],
+        colors = arrays.get('colors'),
+    )
+    meta_data = None
+    if meta['meta_data'] != None:
+        box, sphere, has_color, flags = meta['meta_data']
+        meta_data = LoLSKN.Metadata(
+            bound_box = LoLBox(start = LoLVec3(*box[0:3]), end = LoLVec3(*box[3:6])),
+            bound_sphere = LoLSphere(center = LoLVec3(*sphere[0:3]), radius = sphere[3]),
+            has_color = has_color,
+            flags = flags,
+        )
+    return LoLSKN(
+        meshes = [LoLSKN.SubMesh(*mesh) for mesh in meta['meshes']],
+        indices = arrays['indices'],
+        vertices = LoLSKN.VertexView(vertex_arrays),
+        pivot_point = LoLVec3(*meta['pivot_point']) if meta['pivot_point'] != None else None,
+        meta_data = meta_data,
+        vertex_arrays = vertex_arrays,
+    )
+
+def _skl_encode(skl: LoLSKL) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    joint_index = skl.get_joint_index_table()
+    arrays = {
+        'flags': np.array([joint.flags for joint in skl.joints], dtype = np.uint16),
+        'parent_idx': np.array([joint.parent_idx for joint in skl.joints], dtype = np.int16),
+        'name_hash': np.array([joint.name_hash for joint in skl.joints], dtype = np.uint32),
+        'radius': np.array([joint.radius for joint in skl.joints], dtype = np.float32),
+        'local_transform': np.array([sum(joint.local_transform, ()) for joint in skl.joints], dtype = np.float32).reshape(-1, 10),
+        'inv_root_transform': np.array([sum(joint.inv_root_transform, ()) for joint in skl.joints], dtype = np.float32).reshape(-1, 10),
+        'influences': np.array(skl.influences, dtype = np.int16),
+        'index_hashes': joint_index.hashes,
+        'index_indices': joint_index.indices.astype(np.int32),
+    }
+    meta = {
+        'names': [joint.name for joint in skl.joints],
+        'name': skl.name,
+        'asset_name': skl.asset_name,
+        'flags': skl.flags,
+    }
+    return arrays, meta
+
+def _skl_decode(arrays: Dict[str, np.ndarray], meta: Dict[str, Any]) -> LoLSKL:
+    joints = [
+        LoLSKL.Joint(
+            flags = joint_flags,
+            parent_idx = joint_parent_idx,
+            name_hash = joint_name_hash,
+            radius = joint_radius,
+            local_transform = LoLForm3D.from_floats(joint_local_transform),
+            inv_root_transform = LoLForm3D.from_floats(joint_inv_root_transform),
+            name = joint_name,
+        )
+        for joint_flags, joint_parent_idx, joint_name_hash, joint_radius, joint_local_transform, joint_inv_root_transform, joint_name in zip(
+            arrays['flags'].tolist(), arrays['parent_idx'].tolist(), arrays['name_hash'].tolist(), arrays['radius'].tolist(),
+            arrays['local_transform'].tolist(), arrays['inv_root_transform'].tolist(), meta['names'])
+    ]
+    return LoLSKL(
+        joints = joints,
+        influences = arrays['influences'].tolist(),
+        name = meta['name'],
+        asset_name = meta['asset_name'],
+        flags = meta['flags'],
+        joint_index = LoLSKL.JointIndex.create(joints, arrays['index_hashes'], arrays['index_indices']),
+    )
+
+def _anm_encode(anm: LoLANM) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    tracks = anm.tracks
+    arrays = {
+        'bone_hashes': np.array([track.bone_hash for track in tracks], dtype = np.uint32),
+        'positions': np.array([track.positions for track in tracks], dtype = np.float32).reshape(len(tracks), -1, 3),
+        'scales': np.array([track.scales for track in tracks], dtype = np.float32).reshape(len(tracks), -1, 3),
+        'rotations': np.array([track.rotations for track in tracks], dtype = np.float32).reshape(len(tracks), -1, 4),
+    }
+    meta = {
+        'tick_duration': anm.tick_duration,
+        'asset_name': anm.asset_name,
+        'flags': anm.flags,
+        'jump_step': None,
+    }
+    # Compressed tracks keep their curves, concatenated in (track, rotation | position | scale) order
+    if len(tracks) and all(track.rot_curve != None for track in tracks):
+        curves = [curve for track in tracks for curve in (track.rot_curve, track.pos_curve, track.scale_curve)]
+        jump_count = max((len(curve.jump_keys) for curve in curves if curve.jump_keys is not None), default = 0)
+        jump_keys = np.full((len(curves), jump_count), -1, dtype = np.int32)
+        for i, curve in enumerate(curves):
+            if curve.jump_keys is not None:
+                jump_keys[i] = curve.jump_keys
+        values = np.zeros((sum(len(curve.times) for curve in curves), 4), dtype = np.float64)
+        offsets = np.cumsum([0] + [len(curve.times) for curve in curves])
+        for curve, start in zip(curves, offsets.tolist()):
+            values[start:start + len(curve.values), :curve.values.shape[1]] = curve.values
+        arrays['curve_times'] = np.concatenate([curve.times for curve in curves]).astype(np.float64)
+        arrays['curve_values'] = values
+        arrays['curve_offsets'] = offsets.astype(np.int64)
+        arrays['curve_jump_keys'] = jump_keys
+        meta['jump_step'] = curves[0].jump_step
+    return arrays, meta
+
+def _anm_decode(arrays: Dict[str, np.ndarray], meta: Dict[str, Any]) -> LoLANM:
+    curves = None
+    if meta['jump_step'] != None:
+        offsets = arrays['curve_offsets'].tolist()
+        jump_keys = arrays['curve_jump_keys']
+        curves = []
+        for track_idx in range(len(arrays['bone_hashes'])):
+            track_curves = []
+            for kind in range(0, 3):
+                channel = track_idx * 3 + kind
+                start, end = offsets[channel], offsets[channel + 1]
+                track_curves.append(LoLANM.Curve(
+                    times = arrays['curve_times'][start:end],
+                    values = arrays['curve_values'][start:end, :4 if kind == 0 else 3],
+                    is_rotation = kind == 0,
+                    jump_keys = jump_keys[channel] if len(jump_keys[channel]) and jump_keys[channel, 0] >= 0 else None,
+                    jump_step = meta['jump_step'],
+                ))
+            curves.append(track_curves)
+    return LoLANM(
+        tracks = lol_anm_tracks_from_arrays(arrays['bone_hashes'], arrays['positions'], arrays['scales'], arrays['rotations'], curves),
+        tick_duration = meta['tick_duration'],
+        asset_name = meta['asset_name'],
+        flags = meta['flags'],
+    )
+
+ASSET_CACHE_FORMATS = {
+    '.skn': ('skn', lambda rw: LoLSKN.read(rw, columnar = True), _skn_encode, _skn_decode),
+    '.skl': ('skl', LoLSKL.read, _skl_encode, _skl_decode),
+    '.anm': ('anm', LoLANM.read, _anm_encode, _anm_decode),
+}
+
+class LoLAssetCache:
+    """On-disk cache of parsed SKN/SKL/ANM files keyed by content hash and ASSET_CACHE_VERSION.
+
+    Every entry is a directory of .npy arrays plus a JSON file with the small fields, arrays are
+    memory-mapped on load. Least recently used entries are evicted once the cache exceeds max_size bytes.
+    """
+
+    class Stats(NamedTuple):
+        hits: int
+        misses: int
+        evictions: int
+        entries: int
+        size: int # bytes on disk
+
+    __slots__ = ('cache_dir', 'max_size', 'hits', 'misses', 'evictions', 'entries_', 'digests_')
+
+    def __init__(self, cache_dir: str, max_size: int = 1 << 30):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> entry size, oldest access first. Access times survive restarts as directory mtimes
+        self.entries_ = OrderedDict()
+        # path -> (mtime, size, digest) so unchanged files are not hashed twice per session
+        self.digests_ = {}
+        os.makedirs(cache_dir, exist_ok = True)
+        found = []
+        for key in os.listdir(cache_dir):
+            entry_dir = os.path.join(cache_dir, key)
+            if '.tmp-' in key:
+                shutil.rmtree(entry_dir, ignore_errors = True)
+            elif os.path.isdir(entry_dir):
+                found.append((os.stat(entry_dir).st_mtime_ns, key, self._entry_size(entry_dir)))
+        for _, key, size in sorted(found):
+            self.entries_[key] = size
+        self._evict()
+
+    @staticmethod
+    def _entry_size(entry_dir: str) -> int:
+        return sum(entry.stat().st_size for entry in os.scandir(entry_dir))
+
+    def _key(self, path: str, kind: str) -> str:
+        stat = os.stat(path)
+        memo = self.digests_.get(path)
+        if memo == None or memo[:2] != (stat.st_mtime_ns, stat.st_size):
+            memo = self.digests_[path] = (stat.st_mtime_ns, stat.st_size, lol_file_digest(path))
+        return f'{kind}-{ASSET_CACHE_VERSION}-{memo[2]}'
+
+    def read(self, path: str) -> Union[LoLSKN, LoLSKL, LoLANM]:
+        """Parsed asset picked by extension, SKNs are columnar like LoLSKN.read(..., columnar = True)."""
+        kind, reader, encode, decode = ASSET_CACHE_FORMATS[os.path.splitext(path)[1].lower()]
+        key = self._key(path, kind)
+        entry_dir = os.path.join(self.cache_dir, key)
+        if key in self.entries_:
+            try:
+                asset = self._load(entry_dir, decode)
+            except (OSError, ValueError, KeyError):
+                # Damaged entry, reparse and replace it
+                self._remove(key)
+            else:
+                self.hits += 1
+                self.entries_.move_to_end(key)
+                os.utime(entry_dir)
+                return asset
+
+        self.misses += 1
+        with LoLBufferIO.open(path) as rw:
+            asset = reader(rw)
+        self._store(key, *encode(asset))
+        return asset
+
+    def read_skn(self, path: str) -> LoLSKN:
+        return self.read(path)
+
+    def read_skl(self, path: str) -> LoLSKL:
+        return self.read(path)
+
+    def read_anm(self, path: str) -> LoLANM:
+        return self.read(path)
+
+    def _load(self, entry_dir: str, decode: Callable) -> Any:
+        with open(os.path.join(entry_dir, 'meta.json'), 'r') as file:
+            meta = json.load(file)
+        arrays = {
+            name: np.load(os.path.join(entry_dir, name + '.npy'), mmap_mode = 'r', allow_pickle = False)
+            for name in meta.pop('arrays')
+        }
+        return decode(arrays, meta)
+
+    def _store(self, key: str, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]):
+        # Write to a temporary directory first so a crash never leaves a half written entry
+        entry_dir = os.path.join(self.cache_dir, key)
+        temp_dir = f'{entry_dir}.tmp-{uuid.uuid4().hex}'
+        os.makedirs(temp_dir)
+        try:
+            for name, array in arrays.items():
+                np.save(os.path.join(temp_dir, name + '.npy'), np.ascontiguousarray(array), allow_pickle = False)
+            with open(os.path.join(temp_dir, 'meta.json'), 'w') as file:
+                json.dump(dict(meta, arrays = list(arrays)), file)
+            os.rename(temp_dir, entry_dir)
+        except OSError:
+            # Another process stored the same entry first
+            shutil.rmtree(temp_dir, ignore_errors = True)
+            if not os.path.isdir(entry_dir):
+                raise
+        self.entries_[key] = self._entry_size(entry_dir)
+        self.entries_.move_to_end(key)
+        self._evict()
+
+    def _remove(self, key: str):
+        self.entries_.pop(key, None)
+        shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors = True)
+
+    def _evict(self):
+        size = sum(self.entries_.values())
+        # The newest entry is kept even if it is larger than the cache on its own
+        while size > self.max_size and len(self.entries_) > 1:
+            key, entry_size = next(iter(self.entries_.items()))
+            self._remove(key)
+            size -= entry_size
+            self.evictions += 1
+
+    def get_stats(self) -> LoLAssetCache.Stats:
+        return LoLAssetCache.Stats(
+            hits = self.hits,
+            misses = self.misses,
+            evictions = self.evictions,
+            entries = len(self.entries_),
+            size = sum(self.entries_.values()),
+        )
+
+    def clear(self):
+        for key in list(self.entries_):
+            self._remove(key)
@@ -0,0 +1,281 @@
+from __future__ import annotations
+from typing import NamedTuple, List, Optional, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sqlite3
+import numpy as np
+from ..helper.io_helper import LoLBufferIO
+from .skn_io_imp import LoLSKN
+from .skl_io_imp import LoLSKL
+from .anm_io_imp import LoLANM
+
+# Bump when the schema or what gets stored changes, older databases are rebuilt
+ASSET_INDEX_VERSION = 1
+
+ASSET_INDEX_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    directory TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    version INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS files_by_directory ON files (directory, kind);
+CREATE TABLE IF NOT EXISTS meshes (
+    file_id INTEGER PRIMARY KEY REFERENCES files(id) ON DELETE CASCADE,
+    vtx_total INTEGER NOT NULL,
+    idx_total INTEGER NOT NULL,
+    has_color INTEGER NOT NULL,
+    box_min_x REAL, box_min_y REAL, box_min_z REAL,
+    box_max_x REAL, box_max_y REAL, box_max_z REAL,
+    sphere_x REAL, sphere_y REAL, sphere_z REAL, sphere_radius REAL
+);
+CREATE TABLE IF NOT EXISTS submeshes (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    vtx_start INTEGER NOT NULL,
+    vtx_count INTEGER NOT NULL,
+    idx_start INTEGER NOT NULL,
+    idx_count INTEGER NOT NULL,
+    PRIMARY KEY (file_id, idx)
+);
+CREATE TABLE IF NOT EXISTS skeletons (
+    file_id INTEGER PRIMARY KEY REFERENCES files(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    asset_name TEXT NOT NULL,
+    joint_count INTEGER NOT NULL,
+    influence_count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS joints (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    hash INTEGER NOT NULL,
+    PRIMARY KEY (file_id, idx)
+);
+CREATE INDEX IF NOT EXISTS joints_by_hash ON joints (hash);
+CREATE TABLE IF NOT EXISTS track_sets (
+    id INTEGER PRIMARY KEY,
+    hashes BLOB NOT NULL UNIQUE,
+    hash_count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS track_set_hashes (
+    set_id INTEGER NOT NULL REFERENCES track_sets(id) ON DELETE CASCADE,
+    hash INTEGER NOT NULL,
+    PRIMARY KEY (set_id, hash)
+);
+CREATE INDEX IF NOT EXISTS track_set_hashes_by_hash ON track_set_hashes (hash);
+CREATE TABLE IF NOT EXISTS animations (
+    file_id INTEGER PRIMARY KEY REFERENCES files(id) ON DELETE CASCADE,
+    set_id INTEGER NOT NULL REFERENCES track_sets(id),
+    asset_name TEXT NOT NULL,
+    track_count INTEGER NOT NULL,
+    frame_count INTEGER NOT NULL,
+    fps REAL NOT NULL,
+    duration REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS animations_by_set ON animations (set_id);
+'''
+
+ASSET_INDEX_READERS = {
+    '.skn': LoLSKN,
+    '.skl': LoLSKL,
+    '.anm': LoLANM,
+}
+
+def lol_asset_probe(path: str) -> Union[LoLSKN.Header, LoLSKL.Header, LoLANM.Header]:
+    """Header of a .skn, .skl or .anm file, picked by extension."""
+    reader = ASSET_INDEX_READERS[os.path.splitext(path)[1].lower()]
+    with LoLBufferIO.open(path) as rw:
+        return reader.probe(rw)
+
+class LoLAssetIndex:
+    """SQLite index of SKN/SKL/ANM header facts for large asset trees.
+
+    Files are probed in parallel on scan and only reparsed when their mtime or size changed.
+    """
+
+    class ScanStats(NamedTuple):
+        added: int = 0
+        updated: int = 0
+        removed: int = 0
+        unchanged: int = 0
+        failed: int = 0
+
+    class Compatible(NamedTuple):
+        path: str
+        matched: int     # distinct track hashes that are joints of the skeleton
+        track_count: int # distinct track hashes
+
+        @property
+        def coverage(self) -> float:
+            return self.matched / self.track_count if self.track_count else 1.0
+
+    __slots__ = ('db',)
+
+    def __init__(self, db_path: str = ':memory:'):
+        self.db = sqlite3.connect(db_path)
+        self.db.execute('PRAGMA foreign_keys = ON')
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version != ASSET_INDEX_VERSION:
+            with self.db:
+                for (table,) in self.db.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+                    self.db.execute(f'DROP TABLE IF EXISTS {table}')
+                self.db.execute(f'PRAGMA user_version = {ASSET_INDEX_VERSION}')
+        self.db.executescript(ASSET_INDEX_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self) -> LoLAssetIndex:
+        return self
+
+    def __exit__(self, exec_type, exec_value, exec_trace_back):
+        self.close()
+
+    def scan(self, root: str, workers: Optional[int] = None) -> LoLAssetIndex.ScanStats:
+        """Index every asset below root, files that vanished from root are dropped."""
+        root = os.path.abspath(root)
+        found = {}
+        for dir_path, _, file_names in os.walk(root):
+            for file_name in file_names:
+                if os.path.splitext(file_name)[1].lower() in ASSET_INDEX_READERS:
+                    path = os.path.join(dir_path, file_name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    found[path] = (stat.st_mtime_ns, stat.st_size)
+
+        known = {}
+        prefix = os.path.join(root, '')
+        for file_id, path, mtime_ns, size in self.db.execute('SELECT id, path, mtime_ns, size FROM files'):
+            if path.startswith(prefix):
+                known[path] = (file_id, mtime_ns, size)
+
+        stale = [known[path][0] for path in known if path not in found or found[path] != known[path][1:]]
+        removed = sum(1 for path in known if path not in found)
+        pending = [path for path in found if path not in known or found[path] != known[path][1:]]
+
+        # Probing is mostly waiting on the disk, SQLite is only written from this thread
+        def probe(path: str):
+            try:
+                return lol_asset_probe(path), None
+            except Exception as exception:
+                return None, f'{type(exception).__name__}: {exception}'
+
+        with ThreadPoolExecutor(max_workers = workers) as executor:
+            results = list(executor.map(probe, pending))
+
+        failed = 0
+        with self.db:
+            self.db.executemany('DELETE FROM files WHERE id = ?', [(file_id,) for file_id in stale])
+            for path, (header, error) in zip(pending, results):
+                failed += error != None
+                self._insert(path, found[path], header, error)
+            self.db.execute('DELETE FROM track_sets WHERE id NOT IN (SELECT set_id FROM animations)')
+
+        return LoLAssetIndex.ScanStats(
+            added = sum(1 for path in pending if path not in known),
+            updated = sum(1 for path in pending if path in known),
+            removed = removed,
+            unchanged = len(found) - len(pending),
+            failed = failed,
+        )
+
+    def _insert(self, path: str, stat: Tuple[int, int], header, error: Optional[str]):
+        kind = os.path.splitext(path)[1].lower()[1:]
+        version = getattr(header, 'version', None)
+        file_id = self.db.execute(
+            'INSERT INTO files (path, directory, kind, mtime_ns, size, version, error) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (path, os.path.dirname(path), kind, stat[0], stat[1], version, error),
+        ).lastrowid
+        if header == None:
+            return
+
+        if kind == 'skn':
+            meta_data = header.meta_data
+            bounds = (None,) * 10
+            if meta_data != None:
+                box, sphere = meta_data.bound_box, meta_data.bound_sphere
+                bounds = tuple(box.start) + tuple(box.end) + tuple(sphere.center) + (sphere.radius,)
+            self.db.execute('INSERT INTO meshes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (file_id, header.vtx_total, header.idx_total, meta_data != None and meta_data.has_color) + bounds)
+            self.db.executemany('INSERT INTO submeshes VALUES (?, ?, ?, ?, ?, ?, ?)', [
+                (file_id, idx, mesh.name, mesh.vtx_start, mesh.vtx_count, mesh.idx_start, mesh.idx_count)
+                for idx, mesh in enumerate(header.meshes)
+            ])
+        elif kind == 'skl':
+            self.db.execute('INSERT INTO skeletons VALUES (?, ?, ?, ?, ?)',
+                (file_id, header.name, header.asset_name, header.joint_count, header.influence_count))
+            self.db.executemany('INSERT INTO joints VALUES (?, ?, ?, ?)', [
+                (file_id, idx, name, name_hash)
+                for idx, (name, name_hash) in enumerate(zip(header.joint_names, header.joint_hashes.tolist()))
+            ])
+        elif kind == 'anm':
+            # Animations of one skeleton mostly share their bones, store each distinct set of hashes once
+            hashes = np.unique(np.asarray(header.bone_hashes, dtype = np.uint32))
+            row = self.db.execute('SELECT id FROM track_sets WHERE hashes = ?', (hashes.tobytes(),)).fetchone()
+            if row != None:
+                set_id = row[0]
+            else:
+                set_id = self.db.execute('INSERT INTO track_sets (hashes, hash_count) VALUES (?, ?)',
+                    (hashes.tobytes(), len(hashes))).lastrowid
+                self.db.executemany('INSERT INTO track_set_hashes VALUES (?, ?)', [(set_id, name_hash) for name_hash in hashes.tolist()])
+            self.db.execute('INSERT INTO animations VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (file_id, set_id, header.asset_name, header.track_count, header.frame_count, header.fps, header.duration))
+
+    def _file_id(self, path: str) -> Optional[int]:
+        row = self.db.execute('SELECT id FROM files WHERE path = ?', (os.path.abspath(path),)).fetchone()
+        return row[0] if row != None else None
+
+    def get_compatible_animations(self, skl_path: str, min_coverage: float = 1.0) -> List[LoLAssetIndex.Compatible]:
+        """Animations whose track hashes are joints of the skeleton, best coverage first."""
+        file_id = self._file_id(skl_path)
+        if file_id == None:
+            return []
+        # Start from the skeleton's few joints and the hash index over distinct track sets
+        rows = self.db.execute('''
+            SELECT files.path, matches.matched, track_sets.hash_count
+            FROM (
+                SELECT track_set_hashes.set_id AS set_id, COUNT(DISTINCT track_set_hashes.hash) AS matched
+                FROM joints JOIN track_set_hashes ON track_set_hashes.hash = joints.hash
+                WHERE joints.file_id = ?
+                GROUP BY track_set_hashes.set_id
+            ) AS matches
+            JOIN track_sets ON track_sets.id = matches.set_id
+            JOIN animations ON animations.set_id = matches.set_id
+            JOIN files ON files.id = animations.file_id
+        ''', (file_id,)).fetchall()
+        compatible = [LoLAssetIndex.Compatible(*row) for row in rows]
+        compatible = [animation for animation in compatible if animation.coverage >= min_coverage]
+        compatible.sort(key = lambda animation: (-animation.coverage, animation.path))
+        return compatible
+
+    def _directory_files(self, directory: str, kind: str) -> List[str]:
+        rows = self.db.execute('SELECT path FROM files WHERE directory = ? AND kind = ? AND error IS NULL', (directory, kind))
+        return [path for (path,) in rows]
+
+    def get_skeleton(self, skn_path: str) -> Optional[str]:
+        """Skeleton of a mesh, the .skl next to it with the same name like the importer uses,
+        otherwise the only skeleton in its directory.
+        """
+        skn_path = os.path.abspath(skn_path)
+        skl_path = os.path.normcase(os.path.splitext(skn_path)[0] + '.skl')
+        skeletons = self._directory_files(os.path.dirname(skn_path), 'skl')
+        for path in skeletons:
+            if os.path.normcase(path) == skl_path:
+                return path
+        if len(skeletons) == 1:
+            return skeletons[0]
+        return None
+
+    def get_meshes(self, skl_path: str) -> List[str]:
+        """Meshes that get_skeleton resolves to the skeleton."""
+        skl_path = os.path.abspath(skl_path)
+        meshes = self._directory_files(os.path.dirname(skl_path), 'skn')
+        return [path for path in meshes if self.get_skeleton(path) == skl_path]
@@ -1,10 +1,14 @@
 
-import mathutils
 import bpy;
+import numpy as np
 from os.path import isfile, splitext, basename
+from ..helper.io_helper import lol_vec3_to_blender, LoLHashTable
+from ..helper.math_helper import *
+from ..helper.skeleton_helper import *
 from .skn_io_imp import LoLSKN
-from .skl_io_imp import LoLSKL
-# from .anm_io_imp import LoLANM
+from .skl_cache import LoLSKLCache, LOL_SKL_CACHE
+from .anm_io_imp import LoLANM
+from .anm_sampler import LoLANMSampler
 
 class ImportError(RuntimeError):
     pass
@@ -14,9 +18,101 @@ class sknImporter():
     """SKN Importer class."""
     #TODO: separate to seperate submeshes
 
-    def __init__(self, filename):
+    def __init__(self, filename, merge_influences = False, normalize_weights = False):
         """Initialization."""
         self.filename = filename
+        self.merge_influences = merge_influences
+        self.normalize_weights = normalize_weights
+
+    def create_mesh(self, name, skn):
+        """Create mesh data straight from the SKN vertex arrays."""
+        arrays = skn.get_vertex_arrays()
+        indices = np.asarray(skn.indices, dtype = np.int32)
+        indices = indices[:len(indices) // 3 * 3]
+        loop_count = len(indices)
+        face_count = loop_count // 3
+
+        new_mesh = bpy.data.meshes.new(name)
+        new_mesh.vertices.add(arrays.vertex_count)
+        new_mesh.loops.add(loop_count)
+        new_mesh.polygons.add(face_count)
+
+        # Use correct blender axis order
+        positions = lol_vec3_to_blender(arrays.positions).astype(np.float32)
+        new_mesh.vertices.foreach_set('co', positions.ravel())
+        new_mesh.loops.foreach_set('vertex_index', indices)
+        new_mesh.polygons.foreach_set('loop_start', np.arange(0, loop_count, 3, dtype = np.int32))
+        if bpy.app.version < (4, 0, 0):
+            # Newer versions derive the loop totals from the loop starts
+            new_mesh.polygons.foreach_set('loop_total', np.full(face_count, 3, dtype = np.int32))
+        new_mesh.update(calc_edges = True)
+
+        # Set normals
+        normals = lol_vec3_to_blender(arrays.normals).astype(np.float32)
+        new_mesh.normals_split_custom_set_from_vertices(normals)
+        # new_mesh.shade_smooth()
+        # new_mesh.corner_normals
+        # new_mesh.update()
+        new_mesh.shade_flat()
+
+        # Set UV's per loop, flipped V
+        uv_layer = new_mesh.uv_layers.new(name = 'lolUVTexture')
+        uvs = arrays.uvs[indices]
+        uvs[:, 1] = 1.0 - uvs[:, 1]
+        uv_layer.data.foreach_set('uv', uvs.ravel())
+
+        return new_mesh
+
+    def assign_materials(self, new_mesh, skn):
+        """Create one material per submesh name and set all face material indices at once."""
+        material_names, face_materials = skn.get_face_materials()
+        for material_name in material_names:
+            new_material = bpy.data.materials.new(material_name)
+            new_material.use_nodes = True
+            bsdf = new_material.node_tree.nodes['Principled BSDF']
+            textureImage = new_material.node_tree.nodes.new('ShaderNodeTexImage')
+            new_material.node_tree.links.new(bsdf.inputs['Base Color'], textureImage.outputs['Color'])
+            new_mesh.materials.append(new_material)
+        new_mesh.polygons.foreach_set('material_index', face_materials)
+
+    def assign_weights(self, mesh_object, skn):
+        """Assign skin weights with one call per (vertex group, weight) run."""
+        vertex_groups = mesh_object.vertex_groups
+        weight_groups = skn.get_vertex_arrays().get_weight_groups(
+            merge_duplicates = self.merge_influences,
+            normalize = self.normalize_weights,
+        )
+        for blend_index, weight, vertex_indices in weight_groups:
+            vertex_groups[blend_index].add(vertex_indices.tolist(), weight, 'ADD')
+
+    def create_armature(self, name, skeleton, collection):
+        """Create the armature with one edit bone per joint, kept in joint order and parented by index."""
+        armature = bpy.data.armatures.new(name)
+        armature_object = bpy.data.objects.new(name, armature)
+        collection.objects.link(armature_object)
+
+        # Edit bones only exist in edit mode
+        bpy.context.view_layer.objects.active = armature_object
+        bpy.ops.object.mode_set(mode = 'EDIT')
+
+        # Bones run along the joint Y axis, rolled towards its Z axis
+        skl = skeleton.skl
+        arma_mats = skeleton.world_matrices
+        heads = arma_mats[:, :3, 3]
+        tails = heads + arma_mats[:, :3, 1]
+        z_axes = arma_mats[:, :3, 2]
+
+        edit_bones = [armature.edit_bones.new(joint.name) for joint in skl.joints]
+        armature.edit_bones.foreach_set('head', heads.astype(np.float32).ravel())
+        armature.edit_bones.foreach_set('tail', tails.astype(np.float32).ravel())
+        for edit_bone, joint, z_axis in zip(edit_bones, skl.joints, z_axes.tolist()):
+            edit_bone.use_connect = False
+            edit_bone.align_roll(z_axis)
+            if joint.parent_idx > -1:
+                edit_bone.parent = edit_bones[joint.parent_idx]
+
+        bpy.ops.object.mode_set(mode = 'OBJECT')
+        return armature_object
 
     def read(self):
         """Read file."""
@@ -26,143 +122,165 @@ class sknImporter():
         print('loading', self.filename)
         # Load Mesh
         with open(self.filename, 'rb') as file:
-            skn = LoLSKN.read(file)
+            skn = LoLSKN.read(file, columnar = True)
 
         skl_file = splitext(self.filename)[0]+'.skl'
         print(splitext(self.filename)[0]+'.skl')
         if isfile(skl_file):
-            # Load Skeleton
+            # Load Skeleton, shared with earlier imports of the same file
             mesh_only = False
-            with open(splitext(self.filename)[0]+'.skl', 'rb') as file2:
-                skl = LoLSKL.read(file2)
+            skeleton = LOL_SKL_CACHE.get(skl_file)
         else:
             mesh_only = True
             print('Couldn find', splitext(self.filename)[0]+'.skl')
         
-        # TODO: change to multiple not hardcoded animation files
-        # TEST READ ANIMATION
-        # print('Reading animation file')
-        # with open('C:\\Users\\kokot.p\\Desktop\\LeagueBlenderIO-main\\res\\aatrox_attack1.anm', 'rb') as file3:
-        #     anm = LoLANM.read(file3)
-        #     print(anm.asset_name)
-        
         # TODO: Refactor to a different class
         # Create mesh
-        # Use correct blender axis order
-        vertices = [(t.position.x, -t.position.z, t.position.y) for t in skn.vertices]
-        edges = []
-        faces = []
-        for i in range(int(len(skn.indices) / 3)):
-            # Use correct blender face orientation 
-            faces.append((skn.indices[i*3],skn.indices[i*3+1],skn.indices[i*3+2]))
         name = basename(splitext(self.filename)[0])
-        new_mesh = bpy.data.meshes.new(name)
-        new_mesh.from_pydata(vertices, edges, faces)
-        # Set normals
-        normalList = []
-        for i in range(len(skn.vertices)):
-            vertex = skn.vertices[i]
-            normalList.append(mathutils.Vector(tuple(vertex.normal)))
-        new_mesh.normals_split_custom_set_from_vertices(normalList)
-        # new_mesh.shade_smooth()
-        # new_mesh.corner_normals
-        # new_mesh.update()
-        new_mesh.shade_flat()
-        
+        new_mesh = self.create_mesh(name, skn)
+
         # Create object
         mesh_object = bpy.data.objects.new(name, new_mesh)
 
-        # Set UV's
-        mesh_object.data.uv_layers.new(name='lolUVTexture')
-        uv_layer = mesh_object.data.uv_layers[-1].data
-        uv_set = []
-        for k, loop in enumerate(mesh_object.data.loops):
-            v = loop.vertex_index
-            uv_set.append(skn.vertices[v].uv[0])
-            # flipped V
-            uv_set.append(1 - skn.vertices[v].uv[1])
-        uv_layer.foreach_set('uv', uv_set)
-
         # Create materials and assign faces to materials
-        for i in range(len(skn.meshes)):
-            new_material = bpy.data.materials.new(skn.meshes[i].name)
-            new_material.use_nodes = True
-            bsdf = new_material.node_tree.nodes['Principled BSDF']
-            textureImage = new_material.node_tree.nodes.new('ShaderNodeTexImage')
-            new_material.node_tree.links.new(bsdf.inputs['Base Color'], textureImage.outputs['Color'])
-
-            new_mesh.materials.append(new_material)
-            for j in range(len(faces)):
-                if faces[j][0] >= skn.meshes[i].vtx_start and faces[j][0] < skn.meshes[i].vtx_start + skn.meshes[i].vtx_count:
-                    mesh_object.data.polygons[j].material_index = i
+        self.assign_materials(new_mesh, skn)
 
         if not mesh_only:
             # create vertex groups
-            for i in range(len(skl.influences)):
-                mesh_object.vertex_groups.new(name=skl.joints[skl.influences[i]].name)
+            for influence_name in skeleton.influence_names:
+                mesh_object.vertex_groups.new(name=influence_name)
 
             # bone influence
-            for i in range(len(skn.vertices)):
-                vertex = skn.vertices[i]
-                mesh_object.vertex_groups[vertex.blend_indices[0]].add([i], vertex.blend_weights[0], 'ADD')
-                mesh_object.vertex_groups[vertex.blend_indices[1]].add([i], vertex.blend_weights[1], 'ADD')
-                mesh_object.vertex_groups[vertex.blend_indices[2]].add([i], vertex.blend_weights[2], 'ADD')
-                mesh_object.vertex_groups[vertex.blend_indices[3]].add([i], vertex.blend_weights[3], 'ADD')
-
-
-        # Create Armature
-
-        bpy.ops.object.armature_add(location=(0, 0, 0), enter_editmode=True)
-        obj = bpy.context.active_object
-        armature = obj.data
-
-        # calc bone matrices
-        editbone_arm_mats = []
-        for i in range(len(skl.joints)):
-            bone = skl.joints[i]
-            if bone.parent_idx > -1:
-                parent_editbone_mat = editbone_arm_mats[bone.parent_idx]
-            else:
-                parent_editbone_mat = mathutils.Matrix.Identity(4)
-
-            t, r = bone.local_transform.pos.to_blender(), bone.local_transform.rot.to_blender()
-            local_to_parent = mathutils.Matrix.Translation(t) @ mathutils.Quaternion(r).to_matrix().to_4x4()
-            editbone_arm_mats.append(parent_editbone_mat @ local_to_parent)
-
-        for i in range(len(skl.joints)):
-            bone = skl.joints[i]
-            editbone = armature.edit_bones.new(bone.name)
-            editbone.use_connect = False
-
-            arma_mat = editbone_arm_mats[i]
-            editbone.head = arma_mat @ mathutils.Vector((0,0,0)) 
-
-            editbone.tail = arma_mat @ mathutils.Vector((0,1,0))
-
-            # editbone.length = bone.radius
-            editbone.align_roll(arma_mat @ mathutils.Vector((0, 0, 1)) - editbone.head)
-
-        # set all bone parents
-        for i in range(len(skl.joints)):
-            bone = skl.joints[i]
-            if bone.parent_idx > 0:
-                parent_bone = skl.joints[bone.parent_idx]
-                editbone = armature.edit_bones[bone.name]
-                parent_editbone = armature.edit_bones[parent_bone.name]
-                editbone.parent = parent_editbone
-                # set the tail to parents base
-                editbone.tail = editbone_arm_mats[bone.parent_idx] @ mathutils.Vector((0,0,0))
-
-        # bpy.ops.object.mode_set(mode='OBJECT')
-
-        # link armature to mesh
-        mesh_object.parent = obj
-        # mesh_object.parent_bone = obj.pose.bones[0].name
-        armature_modifier = mesh_object.modifiers.new('armature', type='ARMATURE')
-        armature_modifier.object = obj
+            self.assign_weights(mesh_object, skn)
+
 
         # make collection
         new_collection = bpy.data.collections.new(name)
         bpy.context.scene.collection.children.link(new_collection)
         # add object to scene collection
         new_collection.objects.link(mesh_object)
+
+        if not mesh_only:
+            # Create Armature
+            armature_object = self.create_armature(name, skeleton, new_collection)
+            # Lets the ANM importer find the rest pose again
+            armature_object['lol_skl'] = skl_file
+
+            # link armature to mesh
+            mesh_object.parent = armature_object
+            armature_modifier = mesh_object.modifiers.new('armature', type='ARMATURE')
+            armature_modifier.object = armature_object
+
+class anmImporter():
+    """ANM Importer class."""
+
+    def __init__(self, filename, armature_object, skeleton: LoLSKLCache.Skeleton, hash_table = None):
+        """Initialization."""
+        self.filename = filename
+        self.armature_object = armature_object
+        self.skeleton = skeleton
+        self.skl = skeleton.skl
+        self.hash_table = hash_table if hash_table != None else LoLHashTable()
+
+    def get_bones(self):
+        """Rest matrices, parent indices and SKL joint indices of the armature bones."""
+        bones = self.armature_object.data.bones
+        rest_matrices = np.empty(len(bones) * 16, dtype = np.float32)
+        bones.foreach_get('matrix_local', rest_matrices)
+        # Blender hands out matrices column major
+        rest_matrices = rest_matrices.reshape(-1, 4, 4).transpose(0, 2, 1).astype(np.float64)
+
+        bone_indices = {bone.name: i for i, bone in enumerate(bones)}
+        parent_indices = np.array([bone_indices[bone.parent.name] if bone.parent else -1 for bone in bones], dtype = np.intp)
+        joint_indices = np.array([self.skl.get_joint_index_by_name(bone.name) for bone in bones], dtype = np.intp)
+        return rest_matrices, parent_indices, joint_indices
+
+    def compute_pose(self, anm, fps):
+        """Sample the animation at fps and convert it to pose bone locations, rotations and scales.
+
+        Every array is (frames, bones, channels) with bones in armature order.
+        """
+        positions, scales, rotations, joint_parents = self.skeleton.joint_transforms
+        joint_levels = self.skeleton.joint_levels
+        rest_locals = np.concatenate((positions, scales, rotations), axis = 1)
+
+        # Parent-local LoL transforms of every joint per frame, rest pose where there is no track
+        poses = LoLANMSampler(anm).sample_fps(fps)
+        frame_count = len(poses)
+        local_forms = np.repeat(rest_locals[None], frame_count, axis = 0)
+        track_joints = self.skl.get_joint_indices([track.bone_hash for track in anm.tracks])
+        matched = track_joints > -1
+        local_forms[:, track_joints[matched]] = poses[:, matched]
+        if not matched.all():
+            print('No joints for tracks', self.hash_table.resolve(track.bone_hash for track, found in zip(anm.tracks, matched) if not found))
+
+        # World joint matrices in Blender space, animated and at rest
+        joint_world = lol_matrix_to_blender(lol_world_matrices(
+            lol_form3d_to_matrix(local_forms[..., 0:3], local_forms[..., 3:6], local_forms[..., 6:10]), joint_parents, joint_levels))
+        joint_rest_world = self.skeleton.world_matrices
+
+        # Bones keep their rest offset from the joint they were built from
+        rest_matrices, parent_indices, joint_indices = self.get_bones()
+        has_joint = joint_indices > -1
+        pose_matrices = np.repeat(rest_matrices[None], frame_count, axis = 0)
+        bone_offsets = np.linalg.inv(joint_rest_world[joint_indices[has_joint]]) @ rest_matrices[has_joint]
+        pose_matrices[:, has_joint] = joint_world[:, joint_indices[has_joint]] @ bone_offsets
+
+        # basis = (parent_rest^-1 @ rest)^-1 @ parent_pose^-1 @ pose
+        identity = np.identity(4)
+        has_parent = parent_indices > -1
+        parent_rest = np.where(has_parent[:, None, None], rest_matrices[parent_indices], identity)
+        parent_pose_inv = np.where(has_parent[None, :, None, None], np.linalg.inv(pose_matrices[:, parent_indices]), identity)
+        basis = np.linalg.inv(rest_matrices) @ parent_rest @ parent_pose_inv @ pose_matrices
+
+        locations, rotations, scales = lol_matrix_decompose(basis)
+        rotations = lol_quat_make_continuous(rotations)
+        return locations, rotations, scales, joint_indices
+
+    def create_action(self, name, locations, rotations, scales, joint_indices, frame_start = 1):
+        """Create an action and fill its F-curves with one bulk write per curve."""
+        obj = self.armature_object
+        action = bpy.data.actions.new(name)
+        if obj.animation_data == None:
+            obj.animation_data_create()
+        obj.animation_data.action = action
+
+        frame_count = len(locations)
+        keyframes = np.empty((frame_count, 2), dtype = np.float32)
+        keyframes[:, 0] = frame_start + np.arange(frame_count)
+        for bone_idx, bone in enumerate(obj.data.bones):
+            if joint_indices[bone_idx] < 0:
+                continue
+            pose_bone = obj.pose.bones[bone.name]
+            pose_bone.rotation_mode = 'QUATERNION'
+            for prop, values in (('location', locations), ('rotation_quaternion', rotations), ('scale', scales)):
+                data_path = pose_bone.path_from_id(prop)
+                for i in range(values.shape[-1]):
+                    if bpy.app.version >= (4, 4, 0):
+                        fcurve = action.fcurve_ensure_for_datablock(obj, data_path, index = i, group_name = bone.name)
+                    else:
+                        fcurve = action.fcurves.new(data_path, index = i, action_group = bone.name)
+                    fcurve.keyframe_points.add(frame_count)
+                    keyframes[:, 1] = values[:, bone_idx, i]
+                    fcurve.keyframe_points.foreach_set('co', keyframes.ravel())
+                    fcurve.update()
+        return action
+
+    def read(self):
+        """Read file."""
+        if not isfile(self.filename):
+            raise ImportError('Please select a file')
+
+        print('loading', self.filename)
+        with open(self.filename, 'rb') as file:
+            anm = LoLANM.read(file)
+
+        if self.armature_object.mode == 'EDIT':
+            self.armature_object.update_from_editmode()
+
+        scene = bpy.context.scene
+        fps = scene.render.fps / scene.render.fps_base
+        locations, rotations, scales, joint_indices = self.compute_pose(anm, fps)
+
+        name = basename(splitext(self.filename)[0])
+        return self.create_action(name, locations, rotations, scales, joint_indices, scene.frame_start)
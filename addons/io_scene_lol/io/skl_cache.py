@@ -0,0 +1,104 @@
+from __future__ import annotations
+from typing import List, NamedTuple, Tuple
+from collections import OrderedDict
+import os
+import numpy as np
+from ..helper.io_helper import LoLBufferIO
+from ..helper.skeleton_helper import lol_joint_levels, lol_joint_transforms, lol_skeleton_world_matrices
+from .skl_io_imp import LoLSKL
+
+class LoLSKLCache:
+    """In-process cache of parsed skeletons keyed by path, mtime and size.
+
+    Skins and chromas of a champion share one .skl, so importing them parses it once.
+    Derived data is computed on first use and shared as read-only arrays.
+    """
+
+    class Skeleton:
+        """Parsed LoLSKL with its joint index and lazily derived arrays."""
+
+        __slots__ = ('skl', 'world_matrices_', 'joint_transforms_', 'joint_levels_', 'influence_names_')
+
+        def __init__(self, skl: LoLSKL):
+            self.skl = skl.with_joint_index()
+            self.world_matrices_ = None
+            self.joint_transforms_ = None
+            self.joint_levels_ = None
+            self.influence_names_ = None
+
+        @property
+        def world_matrices(self) -> np.ndarray:
+            """Blender space (J, 4, 4) rest matrices."""
+            if self.world_matrices_ is None:
+                self.world_matrices_ = lol_skeleton_world_matrices(self.skl.joints, blender_space = True)
+                self.world_matrices_.flags.writeable = False
+            return self.world_matrices_
+
+        @property
+        def joint_transforms(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+            """Local positions, scales, rotations and parent indices, see lol_joint_transforms."""
+            if self.joint_transforms_ == None:
+                joint_transforms = lol_joint_transforms(self.skl.joints)
+                for array in joint_transforms:
+                    array.flags.writeable = False
+                self.joint_transforms_ = joint_transforms
+            return self.joint_transforms_
+
+        @property
+        def joint_levels(self) -> List[np.ndarray]:
+            if self.joint_levels_ == None:
+                self.joint_levels_ = lol_joint_levels(self.joint_transforms[3])
+            return self.joint_levels_
+
+        @property
+        def influence_names(self) -> List[str]:
+            """Joint name of every influence, the vertex group names of a skinned mesh."""
+            if self.influence_names_ == None:
+                joints = self.skl.joints
+                self.influence_names_ = [joints[influence].name for influence in self.skl.influences]
+            return self.influence_names_
+
+    class Stats(NamedTuple):
+        hits: int
+        misses: int
+        entries: int
+
+    __slots__ = ('max_entries', 'hits', 'misses', 'entries_')
+
+    def __init__(self, max_entries: int = 16):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # abspath -> (mtime, size, Skeleton), least recently used first
+        self.entries_ = OrderedDict()
+
+    def get(self, path: str) -> LoLSKLCache.Skeleton:
+        """Skeleton of the .skl at path, parsed again only if the file changed."""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = self.entries_.get(path)
+        if entry != None and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+            self.hits += 1
+            self.entries_.move_to_end(path)
+            return entry[2]
+
+        self.misses += 1
+        with LoLBufferIO.open(path) as rw:
+            skeleton = LoLSKLCache.Skeleton(LoLSKL.read(rw))
+        self.entries_[path] = (stat.st_mtime_ns, stat.st_size, skeleton)
+        self.entries_.move_to_end(path)
+        while len(self.entries_) > self.max_entries:
+            self.entries_.popitem(last = False)
+        return skeleton
+
+    def get_stats(self) -> LoLSKLCache.Stats:
+        return LoLSKLCache.Stats(hits = self.hits, misses = self.misses, entries = len(self.entries_))
+
+    def clear(self):
+        self.entries_.clear()
+
+    def __len__(self) -> int:
+        return len(self.entries_)
+
+# Shared by every import in this Blender session
+LOL_SKL_CACHE = LoLSKLCache()
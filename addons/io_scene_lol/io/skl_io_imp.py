@@ -1,8 +1,25 @@
 from __future__ import annotations
 from ..helper.io_helper import *
-from typing import NamedTuple, List, IO
+from typing import NamedTuple, List, IO, Dict, Optional, Tuple
+import numpy as np
 # import mathutils
-        
+
+SKL_JOINT_DTYPE = np.dtype([
+    ('flags', '<u2'),
+    ('idx', '<i2'),
+    ('parent_idx', '<i2'),
+    ('pad', '<u2'),
+    ('name_hash', '<u4'),
+    ('radius', '<f4'),
+    ('local_transform', '<f4', (10,)),
+    ('inv_root_transform', '<f4', (10,)),
+    ('off_name', '<i4'),
+])
+SKL_JOINT_HASH_DTYPE = np.dtype([
+    ('idx', '<i2'),
+    ('pad', '<u2'),
+    ('name_hash', '<u4'),
+])
 
 class LoLSKL(NamedTuple):
     class Joint(NamedTuple):
@@ -14,18 +31,126 @@ class LoLSKL(NamedTuple):
         name: str = ""
         flags: int = 0
 
+    class JointIndex(NamedTuple):
+        """Joint lookup tables, hashes are sorted like the file's joints-by-hash table."""
+        hashes: np.ndarray  # (N,) u32, ascending
+        indices: np.ndarray # (N,) joint index of each hash
+        by_hash: Dict[int, int]
+        by_name: Dict[str, int]
+        joints: Optional[List[LoLSKL.Joint]] = None # the list it was built from
+
+        @staticmethod
+        def create(joints: List[LoLSKL.Joint], hashes: Optional[np.ndarray] = None, indices: Optional[np.ndarray] = None) -> LoLSKL.JointIndex:
+            if hashes is None or indices is None:
+                hashes = np.array([joint.name_hash for joint in joints], dtype = np.uint32)
+                indices = np.arange(len(joints))
+            hashes = np.asarray(hashes, dtype = np.uint32)
+            indices = np.asarray(indices, dtype = np.intp)
+            # Ties sorted by joint index, so every lookup returns the first joint with a hash
+            order = np.lexsort((indices, hashes))
+            hashes, indices = hashes[order], indices[order]
+            by_hash = {}
+            for name_hash, index in zip(hashes.tolist(), indices.tolist()):
+                by_hash.setdefault(name_hash, index)
+            return LoLSKL.JointIndex(
+                hashes = hashes,
+                indices = indices,
+                by_hash = by_hash,
+                by_name = {joint.name: i for i, joint in reversed(list(enumerate(joints)))},
+                joints = joints,
+            )
+
+        def lookup(self, name_hashes: np.ndarray) -> np.ndarray:
+            """Joint indices of (N,) hashes, -1 where there is no such joint."""
+            name_hashes = np.asarray(name_hashes, dtype = np.uint32)
+            if not len(self.hashes):
+                return np.full(name_hashes.shape, -1, dtype = np.intp)
+            positions = np.minimum(np.searchsorted(self.hashes, name_hashes), len(self.hashes) - 1)
+            return np.where(self.hashes[positions] == name_hashes, self.indices[positions], -1)
+
+    class Header(NamedTuple):
+        """Counts, names and joint names/hashes of a SKL, see LoLSKL.probe."""
+        flags: int
+        joint_count: int
+        influence_count: int
+        name: str
+        asset_name: str
+        joint_names: List[str]
+        joint_hashes: np.ndarray # (N,) u32 in joint order
+        off_joints: int
+        off_joints_by_hash: int
+        off_influences: int
+        version: int = 0
+
+    class Lazy:
+        """SKL whose joint transforms and influences are only decoded when first accessed."""
+
+        __slots__ = ('header', 'rw_', 'start_', 'skl_')
+
+        def __init__(self, io_src: IO):
+            self.rw_ = lol_io(io_src)
+            self.start_ = self.rw_.tell()
+            self.header = LoLSKL.probe(self.rw_)
+            self.skl_ = None
+
+        @staticmethod
+        def open(path: str) -> LoLSKL.Lazy:
+            return LoLSKL.Lazy(LoLBufferIO.open(path))
+
+        def close(self):
+            if isinstance(self.rw_, LoLBufferIO):
+                self.rw_.close()
+
+        def __enter__(self) -> LoLSKL.Lazy:
+            return self
+
+        def __exit__(self, exec_type, exec_value, exec_trace_back):
+            self.close()
+
+        @property
+        def joints(self) -> List[LoLSKL.Joint]:
+            return self.load().joints
+
+        @property
+        def influences(self) -> List[int]:
+            return self.load().influences
+
+        def load(self) -> LoLSKL:
+            if self.skl_ == None:
+                with self.rw_.seek_push(self.start_):
+                    self.skl_ = LoLSKL.read(self.rw_)
+            return self.skl_
+
     joints: List[Joint]
     influences: List[int]
     name: str = ""
     asset_name: str = ""
     flags: int = 0    
+    joint_index: Optional[JointIndex] = None
 
     # NOTE: both SKL and Joint flags seems to allways be == 0
 
+    def __eq__(self, other) -> bool:
+        # joint_index is derived from joints, keep its arrays out of the comparison
+        if not isinstance(other, LoLSKL):
+            return NotImplemented
+        return self.joints == other.joints and list(self.influences) == list(other.influences) \
+            and self.name == other.name and self.asset_name == other.asset_name and self.flags == other.flags
+
+    def __ne__(self, other) -> bool:
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
     @staticmethod
-    def read(io_src: IO, full_read = False) -> LoLSKL:
-        rw = LoLIO(io_src)
+    def probe(io_src: IO) -> LoLSKL.Header:
+        """Read the header, names and joint names/hashes without decoding joint transforms or influences."""
+        return LoLSKL._read_header(lol_io(io_src))[0]
 
+    @staticmethod
+    def _read_header(rw: LoLIO) -> Tuple[LoLSKL.Header, np.ndarray]:
+        # The raw joint records come along so read does not fetch them twice
         start = rw.tell()
 
         skl_size = rw.read_u32()
@@ -56,67 +181,125 @@ class LoLSKL(NamedTuple):
             with rw.seek_push(skl_off_asset_name):
                 asset_name = rw.read_zstr()
 
-        joints = []
+        joint_names = []
+        joint_records = np.zeros(0, SKL_JOINT_DTYPE)
         if skl_num_joints and skl_off_joints:
             with rw.seek_push(skl_off_joints):
-                for i in range(0, skl_num_joints):
-                    joint_flags = rw.read_u16()
-                    joint_idx = rw.read_i16()
-                    assert(i == joint_idx)
-                    joint_parent_idx = rw.read_i16()
-                    joint_pad = rw.read_u16()
-                    joint_name_hash = rw.read_u32()
-                    joint_radius = rw.read_f32()
-                    joint_local_transform = rw.read_form3d()
-                    joint_inv_root_transform = rw.read_form3d()
-                    joint_off_name = rw.read_ptr(None)
-                    joint_name = ""
-                    if joint_off_name:
-                        with rw.seek_push(joint_off_name):
-                            joint_name = rw.read_zstr()
-                    joint = LoLSKL.Joint(
-                        flags = joint_flags,
-                        parent_idx = joint_parent_idx,
-                        name_hash = joint_name_hash,
-                        radius = joint_radius,
-                        local_transform = joint_local_transform,
-                        inv_root_transform = joint_inv_root_transform,
-                        name = joint_name,
-                    )
-                    joints.append(joint)
-
-        # Joint name vector
-        if skl_num_joints and skl_off_joint_names and full_read:
-            with rw.seek_push(skl_off_joint_names):
-                for _ in range(0, skl_num_joints):
-                    joint_name = rw.read_zstr()
+                joint_records = rw.read_records(SKL_JOINT_DTYPE, skl_num_joints)
+            # Name pointers are relative to their own field at the end of each record
+            joint_off_names = skl_off_joints + np.arange(skl_num_joints) * SKL_JOINT_DTYPE.itemsize \
+                + SKL_JOINT_DTYPE.fields['off_name'][1] + joint_records['off_name']
+            for joint_ptr_name, joint_off_name in zip(joint_records['off_name'].tolist(), joint_off_names.tolist()):
+                joint_name = ""
+                if joint_ptr_name != 0 and joint_ptr_name != -1:
+                    with rw.seek_push(joint_off_name):
+                        joint_name = rw.read_zstr()
+                joint_names.append(joint_name)
+
+        header = LoLSKL.Header(
+            flags = skl_flags,
+            joint_count = skl_num_joints,
+            influence_count = skl_num_influences,
+            name = name,
+            asset_name = asset_name,
+            joint_names = joint_names,
+            joint_hashes = joint_records['name_hash'],
+            off_joints = skl_off_joints,
+            off_joints_by_hash = skl_off_joints_by_hash,
+            off_influences = skl_off_influences,
+            version = skl_version,
+        )
+        return header, joint_records
+
+    @staticmethod
+    def read(io_src: IO) -> LoLSKL:
+        rw = lol_io(io_src)
+        header, joint_records = LoLSKL._read_header(rw)
+        skl_num_joints = header.joint_count
+        skl_num_influences = header.influence_count
+        skl_off_joints_by_hash = header.off_joints_by_hash
+        skl_off_influences = header.off_influences
+
+        joints = []
+        if len(joint_records):
+            assert((joint_records['idx'] == np.arange(skl_num_joints)).all())
+            for (joint_flags, joint_parent_idx, joint_name_hash, joint_radius, joint_local_transform,
+                    joint_inv_root_transform, joint_name) in zip(
+                    joint_records['flags'].tolist(), joint_records['parent_idx'].tolist(),
+                    joint_records['name_hash'].tolist(), joint_records['radius'].tolist(),
+                    joint_records['local_transform'].tolist(), joint_records['inv_root_transform'].tolist(),
+                    header.joint_names):
+                joint = LoLSKL.Joint(
+                    flags = joint_flags,
+                    parent_idx = joint_parent_idx,
+                    name_hash = joint_name_hash,
+                    radius = joint_radius,
+                    local_transform = LoLForm3D.from_floats(joint_local_transform),
+                    inv_root_transform = LoLForm3D.from_floats(joint_inv_root_transform),
+                    name = joint_name,
+                )
+                joints.append(joint)
 
         # Joint name_hash -> index binary search map
-        if skl_num_joints and skl_off_joints_by_hash and full_read:
+        joint_index = None
+        if skl_num_joints and skl_off_joints_by_hash:
             with rw.seek_push(skl_off_joints_by_hash):
-                for _ in range(0, skl_num_joints):
-                    joint_idx = rw.write_i16()
-                    joint_pad = rw.read_u16()
-                    joint_name_hash = rw.read_u32()
+                hash_records = rw.read_records(SKL_JOINT_HASH_DTYPE, skl_num_joints)
+            # Only trust the table when it is sorted and agrees with the joints
+            hash_indices = hash_records['idx'].astype(np.intp)
+            joint_hashes = np.array([joint.name_hash for joint in joints], dtype = np.uint32)
+            if len(joints) == skl_num_joints \
+                    and (np.diff(hash_records['name_hash'].astype(np.int64)) >= 0).all() \
+                    and ((hash_indices >= 0) & (hash_indices < skl_num_joints)).all() \
+                    and (joint_hashes[np.clip(hash_indices, 0, len(joints) - 1)] == hash_records['name_hash']).all():
+                joint_index = LoLSKL.JointIndex.create(joints, hash_records['name_hash'], hash_indices)
+        if joint_index == None:
+            joint_index = LoLSKL.JointIndex.create(joints)
 
         influences = []
         if skl_num_influences and skl_off_influences:
             with rw.seek_push(skl_off_influences):
-                for _ in range(0, skl_num_influences):
-                    joint_idx = rw.read_i16()
-                    influences.append(joint_idx)
+                influences = rw.read_i16_array(skl_num_influences).tolist()
 
         skl = LoLSKL(
             joints = joints,
             influences = influences,
-            name = name,
-            asset_name = asset_name,
-            flags = skl_flags,
+            name = header.name,
+            asset_name = header.asset_name,
+            flags = header.flags,
+            joint_index = joint_index,
         )
         return skl
 
+    def has_joint_index(self) -> bool:
+        """Whether joint_index was built from the current joints list (it goes stale after _replace(joints = ...))."""
+        return self.joint_index != None and self.joint_index.joints is self.joints
+
+    def get_joint_index_table(self) -> LoLSKL.JointIndex:
+        if self.has_joint_index():
+            return self.joint_index
+        return LoLSKL.JointIndex.create(self.joints)
+
+    def with_joint_index(self) -> LoLSKL:
+        """Copy holding a joint index of the current joints, built once instead of on every lookup."""
+        if self.has_joint_index():
+            return self
+        return self._replace(joint_index = LoLSKL.JointIndex.create(self.joints))
+
+    def get_joint_index(self, name_hash: int) -> int:
+        """Index of the joint with name_hash, -1 if there is none."""
+        return self.get_joint_index_table().by_hash.get(name_hash, -1)
+
+    def get_joint_index_by_name(self, name: str) -> int:
+        """Index of the joint called name, -1 if there is none."""
+        return self.get_joint_index_table().by_name.get(name, -1)
+
+    def get_joint_indices(self, name_hashes: np.ndarray) -> np.ndarray:
+        """Indices of the joints with (N,) name_hashes, -1 where there is none."""
+        return self.get_joint_index_table().lookup(name_hashes)
+
     def write(self, io_dst: IO):
-        rw = LoLIO(io_dst)
+        rw = LoLBuilderIO()
 
         skl_size = 0
         skl_magic = 0x22FD4FC3
@@ -132,66 +315,74 @@ class LoLSKL(NamedTuple):
         skl_off_joint_names = 0
         skl_extra = (0, 0, 0, 0, 0,)
 
-        # We write the header latter
         start = rw.tell()
 
-        with rw.seek_push(start + 64):
-            skl_off_name = rw.tell()
-            rw.write_zstr(self.name)
-            rw.write_align(4)
-
-            skl_off_asset_name = rw.tell()
-            rw.write_zstr(self.asset_name)
-            rw.write_align(4)
-            joint_off_name_by_idx = []
-
-            if skl_num_joints:
-                skl_off_joint_names = rw.tell()
-                for joint in self.joints:
-                    joint_off_name = rw.tell()
-                    rw.write_zstr(joint.name)
-                    rw.write_align(4)
-                    joint_off_name_by_idx.append(joint_off_name)
-
-            if skl_num_joints:
-                skl_off_joints = rw.tell()
-                for idx, joint in enumerate(self.joints):
-                    rw.write_u16(joint.flags)
-                    rw.write_i16(idx)
-                    rw.write_i16(joint.parent_idx)
-                    rw.write_u16(0) # PAD
-                    rw.write_u32(joint.name_hash)
-                    rw.write_f32(joint.radius)
-                    rw.write_form3d(joint.local_transform)
-                    rw.write_form3d(joint.inv_root_transform)
-                    rw.write_ptr(joint_off_name_by_idx[idx], None)
-
-            if skl_num_joints:
-                skl_off_joints_by_hash = rw.tell()
-                for idx, joint in sorted(enumerate(self.joints), key = lambda ij: ij[1].name_hash):
-                    rw.write_i16(idx)
-                    rw.write_u16(0) # PAD
-                    rw.write_u32(joint.name_hash)
-                
-            if skl_num_influences:
-                skl_off_influences = rw.tell()
-                for idx in self.influences:
-                    rw.write_i16(idx)
-                rw.write_align(4)
-            
-            skl_size = rw.tell() - start
-
-        rw.write_u32(skl_size) 
+        # Offsets are patched in once the body is written
+        slot_size = rw.reserve_u32()
         rw.write_u32(skl_magic)
         rw.write_u32(skl_version)
         rw.write_u16(skl_flags)
         rw.write_u16(skl_num_joints)
         rw.write_u32(skl_num_influences)
-        rw.write_ptr(skl_off_joints, start)
-        rw.write_ptr(skl_off_joints_by_hash, start)
-        rw.write_ptr(skl_off_influences, start)
-        rw.write_ptr(skl_off_name, start)
-        rw.write_ptr(skl_off_asset_name, start)
-        rw.write_ptr(skl_off_joint_names, start)
+        slot_off_joints = rw.reserve_ptr()
+        slot_off_joints_by_hash = rw.reserve_ptr()
+        slot_off_influences = rw.reserve_ptr()
+        slot_off_name = rw.reserve_ptr()
+        slot_off_asset_name = rw.reserve_ptr()
+        slot_off_joint_names = rw.reserve_ptr()
         for extra in skl_extra:
             rw.write_u32(extra)
+
+        skl_off_name = rw.tell()
+        rw.write_zstr(self.name)
+        rw.write_align(4)
+
+        skl_off_asset_name = rw.tell()
+        rw.write_zstr(self.asset_name)
+        rw.write_align(4)
+        joint_off_name_by_idx = []
+
+        if skl_num_joints:
+            skl_off_joint_names = rw.tell()
+            for joint in self.joints:
+                joint_off_name = rw.tell()
+                rw.write_zstr(joint.name)
+                rw.write_align(4)
+                joint_off_name_by_idx.append(joint_off_name)
+
+        if skl_num_joints:
+            skl_off_joints = rw.tell()
+            joint_records = np.zeros(skl_num_joints, SKL_JOINT_DTYPE)
+            joint_records['flags'] = [joint.flags for joint in self.joints]
+            joint_records['idx'] = np.arange(skl_num_joints)
+            joint_records['parent_idx'] = [joint.parent_idx for joint in self.joints]
+            joint_records['name_hash'] = [joint.name_hash for joint in self.joints]
+            joint_records['radius'] = [joint.radius for joint in self.joints]
+            joint_records['local_transform'] = [(*joint.local_transform.pos, *joint.local_transform.scale, *joint.local_transform.rot) for joint in self.joints]
+            joint_records['inv_root_transform'] = [(*joint.inv_root_transform.pos, *joint.inv_root_transform.scale, *joint.inv_root_transform.rot) for joint in self.joints]
+            joint_records['off_name'] = np.array(joint_off_name_by_idx) - (skl_off_joints \
+                + np.arange(skl_num_joints) * SKL_JOINT_DTYPE.itemsize + SKL_JOINT_DTYPE.fields['off_name'][1])
+            rw.write_records(joint_records)
+
+        if skl_num_joints:
+            skl_off_joints_by_hash = rw.tell()
+            hash_records = np.zeros(skl_num_joints, SKL_JOINT_HASH_DTYPE)
+            hash_records['idx'] = np.arange(skl_num_joints)
+            hash_records['name_hash'] = joint_records['name_hash']
+            rw.write_records(hash_records[np.argsort(hash_records['name_hash'], kind = 'stable')])
+            
+        if skl_num_influences:
+            skl_off_influences = rw.tell()
+            rw.write_i16_array(self.influences)
+            rw.write_align(4)
+        
+        skl_size = rw.tell() - start
+
+        rw.patch_u32(slot_size, skl_size)
+        rw.patch_ptr(slot_off_joints, skl_off_joints, start)
+        rw.patch_ptr(slot_off_joints_by_hash, skl_off_joints_by_hash, start)
+        rw.patch_ptr(slot_off_influences, skl_off_influences, start)
+        rw.patch_ptr(slot_off_name, skl_off_name, start)
+        rw.patch_ptr(slot_off_asset_name, skl_off_asset_name, start)
+        rw.patch_ptr(slot_off_joint_names, skl_off_joint_names, start)
+        rw.write_to(io_dst)
@@ -1,9 +1,23 @@
 from __future__ import annotations
 
-import math
-from typing import NamedTuple, List, Optional, Tuple, IO
+from typing import NamedTuple, List, Optional, Tuple, IO, Sequence, Union
+
+import numpy as np
 
 from ..helper.io_helper import *
+from ..helper.math_helper import lol_bounding_sphere
+
+# Interleaved on-disk vertex layouts (52 and 56 bytes)
+SKN_VERTEX_DTYPE = np.dtype([
+    ('position', '<f4', (3,)),
+    ('blend_indices', 'u1', (4,)),
+    ('blend_weights', '<f4', (4,)),
+    ('normal', '<f4', (3,)),
+    ('uv', '<f4', (2,)),
+])
+SKN_VERTEX_COLOR_DTYPE = np.dtype(SKN_VERTEX_DTYPE.descr + [
+    ('color', 'u1', (4,)),
+])
 
 class LoLSKN(NamedTuple):
     class SubMesh(NamedTuple):
@@ -24,6 +38,150 @@ class LoLSKN(NamedTuple):
         def get_color(self) -> LoLColor:
             return self.color if self.color != None else LoLColor(0.0, 0.0, 0.0, 0.0)
 
+    class VertexArrays(NamedTuple):
+        positions: np.ndarray       # (N, 3) float32
+        blend_indices: np.ndarray   # (N, 4) uint8
+        blend_weights: np.ndarray   # (N, 4) float32
+        normals: np.ndarray         # (N, 3) float32
+        uvs: np.ndarray             # (N, 2) float32
+        colors: Optional[np.ndarray] = None # (N, 4) uint8
+
+        @property
+        def vertex_count(self) -> int:
+            return len(self.positions)
+
+        @staticmethod
+        def from_vertices(vertices: List[LoLSKN.Vertex]) -> LoLSKN.VertexArrays:
+            if isinstance(vertices, LoLSKN.VertexView):
+                return vertices.arrays
+            has_color = len(vertices) > 0 and all(vtx.color != None for vtx in vertices)
+            colors = None
+            if has_color:
+                colors = np.array([vtx.color for vtx in vertices], np.float32).reshape(-1, 4)
+                colors = np.clip(np.rint(colors * 255.0), 0.0, 255.0).astype(np.uint8)
+            return LoLSKN.VertexArrays(
+                positions = np.array([vtx.position for vtx in vertices], np.float32).reshape(-1, 3),
+                blend_indices = np.array([vtx.blend_indices for vtx in vertices], np.uint8).reshape(-1, 4),
+                blend_weights = np.array([vtx.blend_weights for vtx in vertices], np.float32).reshape(-1, 4),
+                normals = np.array([vtx.normal for vtx in vertices], np.float32).reshape(-1, 3),
+                uvs = np.array([vtx.uv for vtx in vertices], np.float32).reshape(-1, 2),
+                colors = colors,
+            )
+
+        @staticmethod
+        def from_records(records: np.ndarray) -> LoLSKN.VertexArrays:
+            has_color = 'color' in records.dtype.names
+            return LoLSKN.VertexArrays(
+                positions = np.ascontiguousarray(records['position']),
+                blend_indices = np.ascontiguousarray(records['blend_indices']),
+                blend_weights = np.ascontiguousarray(records['blend_weights']),
+                normals = np.ascontiguousarray(records['normal']),
+                uvs = np.ascontiguousarray(records['uv']),
+                colors = np.ascontiguousarray(records['color']) if has_color else None,
+            )
+
+        def get_weight_groups(self, merge_duplicates = False, normalize = False) -> List[Tuple[int, float, np.ndarray]]:
+            """(blend index, weight, vertex indices) runs of non zero influences, split by weight since VertexGroup.add takes one."""
+            vtx_ids = np.repeat(np.arange(self.vertex_count, dtype = np.int32), 4)
+            bone_ids = self.blend_indices.reshape(-1).astype(np.int32)
+            weights = self.blend_weights.reshape(-1).astype(np.float32)
+
+            if merge_duplicates:
+                keys, inverse = np.unique(vtx_ids * 256 + bone_ids, return_inverse = True)
+                weights = np.bincount(inverse.reshape(-1), weights = weights, minlength = len(keys)).astype(np.float32)
+                vtx_ids = (keys // 256).astype(np.int32)
+                bone_ids = (keys % 256).astype(np.int32)
+
+            keep = weights > 0.0
+            vtx_ids, bone_ids, weights = vtx_ids[keep], bone_ids[keep], weights[keep]
+
+            if normalize:
+                totals = np.bincount(vtx_ids, weights = weights, minlength = self.vertex_count)
+                weights = (weights / totals[vtx_ids]).astype(np.float32)
+
+            order = np.lexsort((vtx_ids, weights, bone_ids))
+            vtx_ids, bone_ids, weights = vtx_ids[order], bone_ids[order], weights[order]
+            starts = np.flatnonzero(np.diff(bone_ids, prepend = -1) | (np.diff(weights, prepend = np.float32(-1.0)) != 0))
+            ends = np.append(starts[1:], len(vtx_ids))
+            return [
+                (bone_id, weight, vtx_ids[start:end])
+                for bone_id, weight, start, end in zip(bone_ids[starts].tolist(), weights[starts].tolist(), starts.tolist(), ends.tolist())
+            ]
+
+        def to_records(self, has_color: bool) -> np.ndarray:
+            records = np.empty(self.vertex_count, SKN_VERTEX_COLOR_DTYPE if has_color else SKN_VERTEX_DTYPE)
+            records['position'] = self.positions
+            records['blend_indices'] = self.blend_indices
+            records['blend_weights'] = self.blend_weights
+            records['normal'] = self.normals
+            records['uv'] = self.uvs
+            if has_color:
+                records['color'] = self.colors if self.colors is not None else 0
+            return records
+
+    class VertexView(Sequence):
+        """Lazy read-only list of Vertex over VertexArrays."""
+        __slots__ = ('arrays',)
+
+        def __init__(self, arrays: LoLSKN.VertexArrays):
+            self.arrays = arrays
+
+        def __len__(self) -> int:
+            return self.arrays.vertex_count
+
+        def __getitem__(self, idx: Union[int, slice]) -> Union[LoLSKN.Vertex, List[LoLSKN.Vertex]]:
+            if isinstance(idx, slice):
+                return [self[i] for i in range(*idx.indices(len(self)))]
+            a = self.arrays
+            return LoLSKN.Vertex(
+                position = LoLVec3(*a.positions[idx].tolist()),
+                blend_indices = tuple(a.blend_indices[idx].tolist()),
+                blend_weights = tuple(a.blend_weights[idx].tolist()),
+                normal = LoLVec3(*a.normals[idx].tolist()),
+                uv = LoLVec2(*a.uvs[idx].tolist()),
+                color = LoLColor(*(a.colors[idx] / 255.0).tolist()) if a.colors is not None else None,
+            )
+
+        def __iter__(self):
+            a = self.arrays
+            colors = (a.colors / 255.0).tolist() if a.colors is not None else [None] * a.vertex_count
+            for position, blend_indices, blend_weights, normal, uv, color in zip(
+                    a.positions.tolist(), a.blend_indices.tolist(), a.blend_weights.tolist(),
+                    a.normals.tolist(), a.uvs.tolist(), colors):
+                yield LoLSKN.Vertex(
+                    position = LoLVec3(*position),
+                    blend_indices = tuple(blend_indices),
+                    blend_weights = tuple(blend_weights),
+                    normal = LoLVec3(*normal),
+                    uv = LoLVec2(*uv),
+                    color = LoLColor(*color) if color != None else None,
+                )
+
+    class Bounds(NamedTuple):
+        bound_box: LoLBox
+        bound_sphere: LoLSphere
+
+        @staticmethod
+        def from_positions(positions: np.ndarray, exact_sphere = True) -> LoLSKN.Bounds:
+            """Box and tight sphere of (N, 3) positions, rounded outwards to what float32 can hold.
+
+            The exact minimal sphere usually needs fewer passes over the positions than Ritter's.
+            """
+            positions = np.asarray(positions, dtype = np.float32).reshape(-1, 3)
+            if not len(positions):
+                zero = LoLVec3(0.0, 0.0, 0.0)
+                return LoLSKN.Bounds(bound_box = LoLBox(start = zero, end = zero), bound_sphere = LoLSphere(center = zero, radius = 0.0))
+            box_start = positions.min(axis = 0)
+            box_end = positions.max(axis = 0)
+            center, radius = lol_bounding_sphere(positions, exact = exact_sphere)
+            center = center.astype(np.float32)
+            radius = np.float32(max(radius, np.linalg.norm(positions - center, axis = 1).max()))
+            radius = np.nextafter(radius, np.float32(np.inf))
+            return LoLSKN.Bounds(
+                bound_box = LoLBox(start = LoLVec3(*box_start.tolist()), end = LoLVec3(*box_end.tolist())),
+                bound_sphere = LoLSphere(center = LoLVec3(*center.tolist()), radius = float(radius)),
+            )
+
     class Metadata(NamedTuple):
         bound_box: LoLBox
         bound_sphere: LoLSphere
@@ -33,36 +191,141 @@ class LoLSKN(NamedTuple):
         # NOTE: flags seem to allways be == 0 so we don't care about them as much
 
         @staticmethod
-        def create(vertices: List[LoLSKN.Vertex], flags: int = 0) -> LoLSKN.Metadata:
-            sx = min(vtx.position.x for vtx in vertices)
-            sy = min(vtx.position.y for vtx in vertices)
-            sz = min(vtx.position.z for vtx in vertices)
-            ex = max(vtx.position.x for vtx in vertices)
-            ey = max(vtx.position.y for vtx in vertices)
-            ez = max(vtx.position.z for vtx in vertices)
+        def create(vertices: List[LoLSKN.Vertex], flags: int = 0, exact_sphere = True) -> LoLSKN.Metadata:
+            if isinstance(vertices, LoLSKN.VertexView):
+                positions = vertices.arrays.positions
+                has_color = vertices.arrays.colors is not None
+            else:
+                positions = np.array([vtx.position for vtx in vertices], dtype = np.float32).reshape(-1, 3)
+                has_color = all(vtx.color != None for vtx in vertices)
+            bounds = LoLSKN.Bounds.from_positions(positions, exact_sphere)
             meta_data = LoLSKN.Metadata(
-                bound_box = LoLBox(
-                    start = LoLVec3(x = sx, y = sy, z = sz),
-                    end = LoLVec3(x = ex, y = ey, z = ez),
-                ),
-                bound_sphere = LoLSphere(
-                    center = LoLVec3(x = (sx + ex) / 2.0, y = (sy + ey) / 2.0, z = (sz + ez) / 2.0),
-                    radius = math.sqrt((sx - ex) ** 2 + (sy - ey) ** 2 + (sz - ez) ** 2) / 2.0,
-                ),
-                has_color = all(vtx.color != None for vtx in vertices),
+                bound_box = bounds.bound_box,
+                bound_sphere = bounds.bound_sphere,
+                has_color = has_color,
                 flags = flags
             )
             return meta_data
     
+    class Header(NamedTuple):
+        """Everything in front of the index and vertex data, see LoLSKN.probe."""
+        version: int
+        meshes: List[LoLSKN.SubMesh]
+        idx_total: int
+        vtx_total: int
+        vtx_size: int
+        off_indices: int
+        off_vertices: int
+        pivot_point: Optional[LoLVec3] = None
+        meta_data: Optional[LoLSKN.Metadata] = None
+
+        @property
+        def vertex_dtype(self) -> np.dtype:
+            if self.meta_data != None and self.meta_data.has_color:
+                return SKN_VERTEX_COLOR_DTYPE
+            return SKN_VERTEX_DTYPE
+
+    class Lazy:
+        """SKN whose index and vertex blocks are only decoded when first accessed.
+
+        The header is probed up front, the source has to stay open until everything needed was accessed.
+        """
+
+        __slots__ = ('header', 'rw_', 'indices_', 'vertex_arrays_')
+
+        def __init__(self, io_src: IO):
+            self.rw_ = lol_io(io_src)
+            self.header = LoLSKN.probe(self.rw_)
+            self.indices_ = None
+            self.vertex_arrays_ = None
+
+        @staticmethod
+        def open(path: str) -> LoLSKN.Lazy:
+            return LoLSKN.Lazy(LoLBufferIO.open(path))
+
+        def close(self):
+            if isinstance(self.rw_, LoLBufferIO):
+                self.rw_.close()
+
+        def __enter__(self) -> LoLSKN.Lazy:
+            return self
+
+        def __exit__(self, exec_type, exec_value, exec_trace_back):
+            self.close()
+
+        @property
+        def meshes(self) -> List[LoLSKN.SubMesh]:
+            return self.header.meshes
+
+        @property
+        def indices(self) -> np.ndarray:
+            if self.indices_ is None:
+                with self.rw_.seek_push(self.header.off_indices):
+                    self.indices_ = self.rw_.read_u16_array(self.header.idx_total)
+            return self.indices_
+
+        @property
+        def vertex_arrays(self) -> LoLSKN.VertexArrays:
+            if self.vertex_arrays_ == None:
+                with self.rw_.seek_push(self.header.off_vertices):
+                    vtx_records = self.rw_.read_records(self.header.vertex_dtype, self.header.vtx_total)
+                self.vertex_arrays_ = LoLSKN.VertexArrays.from_records(vtx_records)
+            return self.vertex_arrays_
+
+        @property
+        def vertices(self) -> LoLSKN.VertexView:
+            return LoLSKN.VertexView(self.vertex_arrays)
+
+        def load(self) -> LoLSKN:
+            """Columnar LoLSKN, same as LoLSKN.read(..., columnar = True)."""
+            return LoLSKN(
+                meshes = self.header.meshes,
+                indices = self.indices,
+                vertices = self.vertices,
+                pivot_point = self.header.pivot_point,
+                meta_data = self.header.meta_data,
+                vertex_arrays = self.vertex_arrays,
+            )
+
     meshes: List[SubMesh]
     indices: List[int]
     vertices: List[Vertex]
     pivot_point: Optional[LoLVec3] = None
     meta_data: Optional[Metadata] = None
+    vertex_arrays: Optional[VertexArrays] = None
+
+    # NOTE: with columnar = True indices is an uint16 array and vertices a lazy VertexView over
+    # vertex_arrays, otherwise both are materialized as lists like before and vertex_arrays is None
+
+    def __eq__(self, other) -> bool:
+        # Columnar fields are arrays, compare them by value instead of the tuple's elementwise truth
+        if not isinstance(other, LoLSKN):
+            return NotImplemented
+        if self.meshes != other.meshes or self.pivot_point != other.pivot_point or self.meta_data != other.meta_data:
+            return False
+        if not np.array_equal(np.asarray(self.indices), np.asarray(other.indices)):
+            return False
+        if isinstance(self.vertices, list) and isinstance(other.vertices, list):
+            return self.vertices == other.vertices
+        a, b = self.get_vertex_arrays(), other.get_vertex_arrays()
+        return all(
+            (x is None and y is None) or (x is not None and y is not None and np.array_equal(x, y))
+            for x, y in zip(a, b)
+        )
+
+    def __ne__(self, other) -> bool:
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
 
     @staticmethod
-    def read(io_src: IO) -> LoLSKN:
-        rw = LoLIO(io_src)
+    def probe(io_src: IO) -> LoLSKN.Header:
+        """Read the version, submesh table, counts, bounds and pivot without touching the bulk data.
+
+        Bounds are only stored by v4 files. Leaves the cursor at the start of the indices.
+        """
+        rw = lol_io(io_src)
         skn_magic = rw.read_u32()
         skn_version_minor = rw.read_u16()
         skn_version_major = rw.read_u16()
@@ -98,8 +361,9 @@ class LoLSKN(NamedTuple):
         meta_data = None
         skn_idx_total = 0
         skn_vtx_total = 0
+        skn_vtx_size = SKN_VERTEX_DTYPE.itemsize
 
-        # Read geometry data
+        # Read geometry header
         if skn_version_minor >= 4:
             skn_flags = rw.read_u32()
             skn_idx_total = rw.read_u32()
@@ -120,48 +384,59 @@ class LoLSKN(NamedTuple):
             skn_idx_total = rw.read_u32()
             skn_vtx_total = rw.read_u32()
 
-        indices = []
-        for _ in range(0, skn_idx_total):
-            idx = rw.read_u16()
-            indices.append(idx)
-        
-        vertices = []
-        for _ in range(0, skn_vtx_total):
-            vtx_position = rw.read_vec3()
-            vtx_blend_indices = (rw.read_u8(), rw.read_u8(), rw.read_u8(), rw.read_u8(),)
-            vtx_blend_weights = (rw.read_f32(), rw.read_f32(), rw.read_f32(), rw.read_f32(),)
-            vtx_normal = rw.read_vec3()
-            vtx_uv = rw.read_vec2()
-            vtx_color = None
-            if meta_data != None and meta_data.has_color:
-                vtx_color = rw.read_color()
-            vtx = LoLSKN.Vertex(
-                position = vtx_position,
-                blend_indices = vtx_blend_indices,
-                blend_weights = vtx_blend_weights,
-                normal = vtx_normal,
-                uv = vtx_uv,
-                color = vtx_color,
-            )
-            vertices.append(vtx)
-
+        # Index and vertex blocks are fixed size, the pivot point directly follows them
+        off_indices = rw.tell()
+        off_vertices = off_indices + skn_idx_total * 2
         pivot_point = None
         if skn_version_minor >= 2:
-            pivot_point = rw.read_vec3()
+            with rw.seek_push(off_vertices + skn_vtx_total * skn_vtx_size):
+                pivot_point = rw.read_vec3()
 
-        skn = LoLSKN(
+        header = LoLSKN.Header(
+            version = skn_version_minor,
             meshes = meshes,
-            indices = indices,
-            vertices = vertices,
+            idx_total = skn_idx_total,
+            vtx_total = skn_vtx_total,
+            vtx_size = skn_vtx_size,
+            off_indices = off_indices,
+            off_vertices = off_vertices,
             pivot_point = pivot_point,
             meta_data = meta_data,
         )
+        return header
+
+    @staticmethod
+    def read(io_src: IO, columnar = False) -> LoLSKN:
+        rw = lol_io(io_src)
+        header = LoLSKN.probe(rw)
+
+        # Read index and vertex blocks in one bulk pass each
+        indices = rw.read_u16_array(header.idx_total)
+        vtx_records = rw.read_records(header.vertex_dtype, header.vtx_total)
+        vertex_arrays = LoLSKN.VertexArrays.from_records(vtx_records)
+
+        vertices = LoLSKN.VertexView(vertex_arrays)
+        if not columnar:
+            # Lists are the only copy, cached arrays would go stale once they are edited
+            indices = indices.tolist()
+            vertices = list(vertices)
+            vertex_arrays = None
+
+        if header.pivot_point != None:
+            rw.read_vec3()
+
+        skn = LoLSKN(
+            meshes = header.meshes,
+            indices = indices,
+            vertices = vertices,
+            pivot_point = header.pivot_point,
+            meta_data = header.meta_data,
+            vertex_arrays = vertex_arrays,
+        )
 
         return skn
 
     def write(self, io_dst: IO, request_version = None):
-        rw = LoLIO(io_dst)
-
         skn_magic = 0x00112233
         skn_version_minor = 0
         skn_version_major = 1
@@ -179,6 +454,27 @@ class LoLSKN(NamedTuple):
             assert (request_version in range(0, 5))
             skn_version_minor = request_version
 
+        # Only version 4 carries a vertex type, older versions allways use the 52 byte layout
+        meta_data = None
+        has_color = False
+        if skn_version_minor >= 4:
+            meta_data = self.get_meta_data()
+            has_color = meta_data.has_color
+
+        vtx_records = self.get_vertex_arrays().to_records(has_color)
+        idx_total = len(self.indices)
+        vtx_total = len(vtx_records)
+
+        # Serialize everything into a single preallocated buffer
+        size = 8
+        if skn_version_minor >= 1:
+            size += 4 + 80 * len(self.meshes)
+        size += 60 if skn_version_minor >= 4 else 8
+        size += idx_total * 2 + vtx_records.nbytes
+        if skn_version_minor >= 2:
+            size += 12
+        rw = LoLBuilderIO(size)
+
         rw.write_u32(skn_magic)
         rw.write_u16(skn_version_minor)
         rw.write_u16(skn_version_major)
@@ -193,35 +489,26 @@ class LoLSKN(NamedTuple):
                 rw.write_i32(mesh.idx_count)
 
         if skn_version_minor >= 4:
-            meta_data = self.get_meta_data()
             rw.write_u32(meta_data.flags) # flags
-            rw.write_u32(len(self.indices))
-            rw.write_u32(len(self.vertices))
-            rw.write_u32(56 if meta_data.has_color else 52)
-            rw.write_u32(1 if meta_data.has_color else 0)
+            rw.write_u32(idx_total)
+            rw.write_u32(vtx_total)
+            rw.write_u32(vtx_records.dtype.itemsize)
+            rw.write_u32(1 if has_color else 0)
             rw.write_box(meta_data.bound_box)
             rw.write_sphere(meta_data.bound_sphere)
         else:
-            rw.write_u32(len(self.indices))
-            rw.write_u32(len(self.vertices))
-
-        for idx in self.indices:
-            rw.write_u16(idx)
-
-        for vtx in self.vertices:
-            rw.write_vec3(vtx.position)
-            for i in range(0, 4):
-                rw.write_u8(vtx.blend_indices[i])
-            for i in range(0, 4):
-                rw.write_f32(vtx.blend_weights[i])
-            rw.write_vec3(vtx.normal)
-            rw.write_vec2(vtx.uv)
-            if self.vtx_type != 0:
-                rw.write_color(vtx.get_color())
+            rw.write_u32(idx_total)
+            rw.write_u32(vtx_total)
+
+        rw.write_u16_array(self.indices)
+        rw.write_records(vtx_records)
 
         if skn_version_minor >= 2:
             rw.write_vec3(self.get_pivot_point())
 
+        assert(rw.size == size)
+        rw.write_to(io_dst)
+
     def get_pivot_point(self) -> LoLVec3:
         if self.pivot_point != None:
             return self.pivot_point
@@ -231,3 +518,31 @@ class LoLSKN(NamedTuple):
         if self.meta_data != None:
             return self.meta_data
         return LoLSKN.Metadata.create(self.vertices)
+
+    def get_submesh_bounds(self, exact_sphere = True) -> List[Bounds]:
+        """Bounds of every submesh over the vertices its indices reference."""
+        positions = self.get_vertex_arrays().positions
+        indices = np.asarray(self.indices)
+        return [
+            LoLSKN.Bounds.from_positions(positions[np.unique(indices[mesh.idx_start:mesh.idx_start + mesh.idx_count])], exact_sphere)
+            for mesh in self.meshes
+        ]
+
+    def get_face_materials(self) -> Tuple[List[str], np.ndarray]:
+        """Unique submesh names and the index into them for every face, from the submesh index ranges."""
+        material_names = []
+        material_by_name = {}
+        face_materials = np.zeros(len(self.indices) // 3, dtype = np.int32)
+        for mesh in self.meshes:
+            material = material_by_name.get(mesh.name)
+            if material == None:
+                material = material_by_name[mesh.name] = len(material_names)
+                material_names.append(mesh.name)
+            face_materials[mesh.idx_start // 3:(mesh.idx_start + mesh.idx_count) // 3] = material
+        return material_names, face_materials
+
+    def get_vertex_arrays(self) -> VertexArrays:
+        # The cached arrays are only current while vertices is still the view over them
+        if isinstance(self.vertices, LoLSKN.VertexView):
+            return self.vertices.arrays
+        return LoLSKN.VertexArrays.from_vertices(self.vertices)